@@ -0,0 +1,182 @@
+'''AsyncESPEC.py: asyncio interface for ESPEC chambers.
+AsyncSH241 exposes the SH241 command set as coroutines and runs the task list as a coroutine instead of scheduler
+callbacks. Serial I/O stays on the chamber's CommandBus worker and coroutines await its futures, so any number of
+chambers and web clients can share one event loop without a thread per timer.
+'''
+
+import asyncio
+from datetime import datetime
+
+from ESPEC import SH241
+from Tasks import TaskKind
+from CommandBus import PRIORITY_CONTROL
+from CommandBus import PRIORITY_MONITOR
+from Commands import is_ack
+from Commands import is_mon_reply
+from Commands import is_temp_reply
+from Commands import text
+
+class AsyncSH241(SH241):
+    '''
+    Takes the same address/bus/port arguments as SH241. The poller thread is replaced by a polling coroutine started
+    by open(), which reads the temperature every poll_interval seconds (kept as poll_seconds; poll_interval is the
+    inherited AdaptivePollInterval the engine methods use).
+    '''
+    def __init__(self, address=1, bus=None, poll_interval=3.0, port=None):
+        super().__init__(address=address, bus=bus, poll=False, port=port)
+        self.poll_seconds = poll_interval
+        self._poll_task = None
+        self._runner = None
+
+    async def _aquery(self, cmd, timeout=1, priority=PRIORITY_CONTROL, validate=None):
+        reply = await asyncio.wrap_future(self._bus.Submit(cmd, timeout, priority, validate))
+        return self._checkQueryReply(cmd, reply, timeout)
+
+    #Cached reply to verb (see Cache.py), or the reply to cmd, which is then cached
+    async def _acached(self, verb, cmd, validate=None):
+        reply = self.reply_cache.get(verb)
+        if reply is None:
+            generation = self.reply_cache.generation(verb)
+            reply = await self._aquery(cmd, priority=PRIORITY_MONITOR, validate=validate)
+            self.reply_cache.put(verb, reply, generation)
+        return text(reply)
+
+    async def _acommand(self, cmd, timeout=1):
+        reply = await asyncio.wrap_future(self._bus.Submit(cmd, timeout, PRIORITY_CONTROL, is_ack))
+        return self._checkCommandReply(cmd, reply, timeout)
+
+    #Opens the port (if this chamber owns it), puts the chamber in standby and starts polling
+    async def open(self):
+        self.reply_cache.clear()
+        if self._owns_port:
+            await asyncio.wrap_future(self._bus.Call(self._instr.Open))
+            await asyncio.wrap_future(self._bus.Call(self._instr.Purge))
+        await self.set_mode_standby()
+        if self._poll_task is None:
+            self._poll_task = asyncio.create_task(self._pollLoop())
+
+    async def close(self):
+        await self.stop_tasks()
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            self._poll_task = None
+        if self._owns_port:
+            await asyncio.wrap_future(self._bus.Call(self._instr.Close))
+
+    #Returns the present temperature as a float
+    async def get_temp(self):
+        self._temp = await self._acached("TEMP?", '%i,TEMP?' % self._address, is_temp_reply)
+        return float(self._temp.split(',')[0])
+
+    async def get_condition(self):
+        self._cond = await self._acached("MON?", '%i,MON?' % self._address, is_mon_reply)
+        return self._cond
+
+    async def set_temp(self, temp):
+        reply = await self._acommand('%i,TEMP,S%.1f' % (self._address, temp))
+        self.reply_cache.invalidate("TEMP?")
+        return reply
+
+    async def set_mode_standby(self):
+        reply = await self._acommand('%i,MODE,STANDBY' % self._address, timeout=2)
+        self.reply_cache.invalidate("MODE?", "MON?")
+        return reply
+
+    async def set_mode_constant(self):
+        reply = await self._acommand('%i,MODE,CONSTANT' % self._address, timeout=2)
+        self.reply_cache.invalidate("MODE?", "MON?")
+        return reply
+
+    async def set_mode_off(self):
+        reply = await self._acommand('%i,MODE,OFF' % self._address, timeout=2)
+        self.reply_cache.invalidate("MODE?", "MON?")
+        return reply
+
+    async def _pollLoop(self):
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                self.temperature = await self.get_temp()
+            except Exception as e:
+                print(f"Error occurred while checking temperature: {e}")
+
+    #Starts run_tasks in the background and returns its asyncio task
+    def start_tasks(self):
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self.run_tasks())
+        return self._runner
+
+    #Cancels the running task list; run_tasks puts the chamber back in standby on the way out
+    async def stop_tasks(self):
+        if self._runner is not None and not self._runner.done():
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+        self._runner = None
+
+    '''
+    Runs every task in the list in order: soaks, idles and cycles, then leaves the chamber in standby.
+    Sets task_done after each finished task, as the callback-driven engine does.
+    '''
+    async def run_tasks(self):
+        self.stop_task = False
+        try:
+            while True:
+                #A cycle task stays queued until its last cycle is done
+                node = self._tasklist.pop_head(keep=lambda task: task.kind is TaskKind.CYCLE)
+                if node is None:
+                    break
+                task = node.data
+                if task.kind is TaskKind.TASK:
+                    await self.soak(task.temp, task.durationInSeconds)
+                elif task.kind is TaskKind.IDLE:
+                    print(f"Idling for {task.durationInSeconds}s")
+                    self.state = "IDLE"
+                    await self.set_mode_standby()
+                    await asyncio.sleep(task.durationInSeconds)
+                else:
+                    self.mode = "CYCLE"
+                    for cycle in range(1, task.totalCycles + 1):
+                        self.currentCycle = cycle
+                        for half, temp in enumerate((task.temp1, task.temp2)):
+                            self.halfCycle = half + 1
+                            print(f"Starting cycle {cycle}: Soak at {temp}°C for {task.durationInSeconds}s")
+                            await self.soak(temp, task.durationInSeconds)
+                    self._tasklist.remove(node)
+                    self.currentCycle = 1
+                    self.halfCycle = 0
+                self.task_done = True
+            print("All tasks completed. Putting chamber in Standby.")
+        finally:
+            self.state = "IDLE"
+            self.mode = "STANDBY"
+            await self.set_mode_standby()
+
+    #Goes to target and holds it for durationInSeconds, counted from when the target is reached
+    async def soak(self, target, durationInSeconds):
+        await self.set_temp(target)
+        await self.set_mode_constant()
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            present = float(self.temperature)
+            if abs(present - target) <= 1:
+                break
+            self.state = "HEATING" if present < target else "COOLING"
+        self.state = "SOAKING"
+        print(f"Target {target}°C Reached at {datetime.now()}. Starting Soak for {durationInSeconds}s.")
+        await asyncio.sleep(durationInSeconds)
+
+'''
+Async entry point: opens the chambers and runs their task lists concurrently on the current event loop.
+Usage: asyncio.run(run_chambers([AsyncSH241(address=1)]))
+'''
+async def run_chambers(chambers):
+    for chamber in chambers:
+        await chamber.open()
+    try:
+        await asyncio.gather(*(chamber.start_tasks() for chamber in chambers))
+    finally:
+        for chamber in chambers:
+            await chamber.close()
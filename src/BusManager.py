@@ -0,0 +1,74 @@
+'''BusManager.py: Drives several ESPEC chambers daisy-chained on one RS-485 line.
+The manager owns the port and its command bus, hands out an SH241 handle per chamber address and polls all
+chambers from a single thread, round-robin, at a configurable aggregate rate.
+'''
+
+import threading
+
+from UART import UARTMaster
+from CommandBus import CommandBus
+from ESPEC import SH241
+
+class BusManager:
+    '''
+    port: Serial port of the RS-485 adapter. If None, the port is autodetected by pinging the first address.
+    addresses: Controller addresses of the chambers on the line.
+    poll_rate: Total temperature polls per second shared by all chambers (each chamber is polled every
+               len(addresses) / poll_rate seconds).
+    '''
+    def __init__(self, port=None, addresses=(1,), poll_rate=1.0, use_rs485=True):
+        if port is None:
+            self._instr = UARTMaster(use_rs485=use_rs485, device_address=addresses[0])
+        else:
+            self._instr = UARTMaster(port=port, use_rs485=use_rs485, device_address=addresses[0], autodetect=False)
+        self._bus = CommandBus(self._instr)
+        self.poll_rate = poll_rate
+        self.chambers = {}
+        self._poller = None
+        self._stop_event = threading.Event()
+        for address in addresses:
+            self.AddChamber(address)
+
+    #Returns the SH241 handle for an address already on the bus
+    def Chamber(self, address):
+        return self.chambers[address]
+
+    def AddChamber(self, address):
+        if address not in self.chambers:
+            self.chambers[address] = SH241(address=address, bus=self._bus, poll=False)
+        return self.chambers[address]
+
+    def RemoveChamber(self, address):
+        self.chambers.pop(address, None)
+
+    #Opens the shared port, puts every chamber in standby and starts the poller
+    def Open(self):
+        self._bus.Call(self._instr.Open).result()
+        self._bus.Call(self._instr.Purge).result()
+        for chamber in list(self.chambers.values()):
+            chamber.OpenChannel()
+        if self._poller is None:
+            self._stop_event.clear()
+            self._poller = threading.Thread(target=self._pollLoop, daemon=True)
+            self._poller.start()
+
+    def Close(self):
+        self._stop_event.set()
+        if self._poller is not None:
+            self._poller.join()
+            self._poller = None
+        self._bus.Call(self._instr.Close).result()
+
+    #Polls one chamber per tick, cycling through the addresses on the line
+    def _pollLoop(self):
+        index = 0
+        while not self._stop_event.wait(1.0 / self.poll_rate):
+            chambers = list(self.chambers.items())
+            if not chambers:
+                continue
+            address, chamber = chambers[index % len(chambers)]
+            index += 1
+            try:
+                chamber.PollOnce()
+            except Exception as e:
+                print(f"Error occurred while checking temperature of chamber {address}: {e}")
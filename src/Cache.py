@@ -0,0 +1,74 @@
+'''Cache.py: Read-through cache of controller replies to read-only queries, keyed by query verb (e.g. "TEMP?").
+Each verb has its own time to live: TYPE? never changes, MON? and TEMP? are fresh for a few seconds. Setters
+invalidate the verbs they change, and a reply read while an invalidation happened is not stored, so a read that
+raced a setter can never put the old value back.
+'''
+
+import threading
+import time
+
+#Seconds each query's reply stays fresh; None caches it for the life of the connection
+DEFAULT_TTLS = {
+    "TYPE?": None,
+    "MON?": 2.0,
+    "TEMP?": 2.0,
+    "MODE?": 2.0,
+}
+
+class ReplyCache:
+    '''
+    ttls: {verb: seconds or None}. Verbs not listed are never cached.
+    '''
+    def __init__(self, ttls=None):
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.hits = 0
+        self.misses = 0
+        self._entries = {} #Verb -> (reply, expiry or None)
+        self._generations = {} #Verb -> times it was invalidated
+        self._lock = threading.Lock()
+
+    #Fresh reply to verb, or None
+    def get(self, verb):
+        with self._lock:
+            entry = self._entries.get(verb)
+            if entry is not None and (entry[1] is None or time.monotonic() < entry[1]):
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    #Token to pass to put, taken before the query is sent
+    def generation(self, verb):
+        with self._lock:
+            return self._generations.get(verb, 0)
+
+    #Stores a reply unless verb is not cached or was invalidated since generation was taken
+    def put(self, verb, reply, generation=None):
+        if verb not in self.ttls:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generations.get(verb, 0):
+                return
+            ttl = self.ttls[verb]
+            self._entries[verb] = (reply, None if ttl is None else time.monotonic() + ttl)
+
+    '''
+    Returns the cached reply to verb, or calls query() for it and caches the result. Errors raised by query are
+    not cached.
+    '''
+    def fetch(self, verb, query):
+        reply = self.get(verb)
+        if reply is None:
+            generation = self.generation(verb)
+            reply = query()
+            self.put(verb, reply, generation)
+        return reply
+
+    def invalidate(self, *verbs):
+        with self._lock:
+            for verb in verbs:
+                self._entries.pop(verb, None)
+                self._generations[verb] = self._generations.get(verb, 0) + 1
+
+    def clear(self):
+        self.invalidate(*self.ttls)
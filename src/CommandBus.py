@@ -0,0 +1,60 @@
+'''CommandBus.py: Serializes all traffic on a serial port through a single worker thread.
+Transactions are queued by priority so control commands preempt monitoring reads, and each caller gets a future
+that resolves to the reply of its own command.
+'''
+
+import itertools
+import queue
+import threading
+from concurrent.futures import Future
+
+#Lower values are served first; requests with the same priority are served in submission order
+PRIORITY_CONTROL = 0
+PRIORITY_MONITOR = 10
+PRIORITY_SHUTDOWN = 100
+
+class CommandBus:
+    def __init__(self, uart):
+        self.uart = uart
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    '''
+    Queues a command for the port and returns a Future resolving to the reply (None if no valid reply came back,
+    see UARTMaster.Transact for validate).
+    '''
+    def Submit(self, cmd, timeout=1, priority=PRIORITY_CONTROL, validate=None):
+        return self.Call(lambda: self.uart.Transact(cmd, timeout, validate), priority)
+
+    #Sends a command and blocks until its reply is in
+    def Transact(self, cmd, timeout=1, priority=PRIORITY_CONTROL, validate=None):
+        return self.Submit(cmd, timeout, priority, validate).result()
+
+    '''
+    Runs fn on the worker thread, in turn with queued transactions.
+    Used for anything that touches the port directly (Open, Close, Purge) so it can never interleave with a command.
+    '''
+    def Call(self, fn, priority=PRIORITY_CONTROL):
+        future = Future()
+        self._queue.put((priority, next(self._sequence), fn, future))
+        return future
+
+    #Serves everything already queued, then stops the worker thread
+    def Stop(self):
+        self.Call(None, PRIORITY_SHUTDOWN)
+        self._worker.join()
+
+    def _run(self):
+        while True:
+            priority, seq, fn, future = self._queue.get()
+            if fn is None:
+                future.set_result(None)
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn())
+            except Exception as e:
+                future.set_exception(e)
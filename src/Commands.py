@@ -0,0 +1,53 @@
+'''Commands.py: Pre-encoded commands for the polling and task transition paths.
+A CommandTable holds the wire bytes (terminator included) of the fixed commands of one controller address, built
+once, so a poll writes a ready bytes object instead of formatting a string, appending CR LF and encoding it every
+time. Transactions sent as bytes also get their reply back as bytes, which MonitorSnapshot parses without
+decoding: float() and int() accept ASCII bytes directly.
+'''
+
+import re
+
+TERMINATOR = b'\r\n'
+
+#Shapes of valid replies to the polled queries, checked before a reply is used so a garbled line is retried.
+#A refusal (NA:...) is valid too; it is reported instead of retried.
+_NUMBER = rb'\s*-?\d+(?:\.\d+)?\s*'
+MON_REPLY = re.compile(rb'NA:.*|' + _NUMBER + rb',(?:' + _NUMBER + rb')?,\s*[A-Z][A-Z0-9 ]*,\s*\d+\s*(?:,.*)?')
+TEMP_REPLY = re.compile(rb'NA:.*|' + _NUMBER + rb'(?:,(?:' + _NUMBER + rb')?){3}(?:,.*)?')
+
+def _matches(pattern, reply):
+    if isinstance(reply, str):
+        reply = reply.encode('ascii', errors='replace')
+    return pattern.fullmatch(reply) is not None
+
+def is_mon_reply(reply):
+    return _matches(MON_REPLY, reply)
+
+def is_temp_reply(reply):
+    return _matches(TEMP_REPLY, reply)
+
+#Valid reply to a setting command: acknowledged or refused
+def is_ack(reply):
+    return reply[:3] in ('OK:', 'NA:', b'OK:', b'NA:')
+
+class CommandTable:
+    def __init__(self, address):
+        self.address = address
+        prefix = b'%i,' % address
+        self.MON = prefix + b'MON?' + TERMINATOR
+        self.TEMP = prefix + b'TEMP?' + TERMINATOR
+        self.PRGM_MON = prefix + b'PRGM MON?' + TERMINATOR
+        self.MODE_OFF = prefix + b'MODE,OFF' + TERMINATOR
+        self.MODE_STANDBY = prefix + b'MODE,STANDBY' + TERMINATOR
+        self.MODE_CONSTANT = prefix + b'MODE,CONSTANT' + TERMINATOR
+        self._set_temp = prefix + b'TEMP,S'
+
+    #Set point command, formatted straight into bytes
+    def SetTemp(self, temp):
+        return b'%s%.1f\r\n' % (self._set_temp, temp)
+
+#Readable form of a command or reply for messages
+def text(data):
+    if isinstance(data, (bytes, bytearray)):
+        return data.decode('ascii', errors='replace').strip()
+    return data
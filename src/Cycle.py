@@ -1,13 +1,15 @@
 from Tasks import Task
+from Tasks import TaskKind
 class Cycle(Task):
-    def __init__(self, temp1, temp2, hours, minutes, seconds, totalCycles, taskName, db_id):
-        self.temp1 = temp1
-        self.temp2 = temp2
-        self.hours = str(hours)
-        self.minutes = str(minutes)
-        self.seconds = str(seconds)
-        self.durationInSeconds = (hours * 3600 + minutes * 60 + seconds)
-        self.totalCycles = totalCycles
-        self.taskName = taskName
+    __slots__ = ('temp1', 'temp2', 'totalCycles')
+
+    def __init__(self, temp1, temp2, hours, minutes, seconds, totalCycles, taskName="Cycle", db_id=None):
+        self.kind = TaskKind.CYCLE
+        self.temp1 = float(temp1)
+        self.temp2 = float(temp2)
+        #temp is the first set point of the cycle
+        self.temp = self.temp1
+        self.durationInSeconds = int(hours * 3600 + minutes * 60 + seconds)
+        self.totalCycles = int(totalCycles)
         self.db_id = db_id
         return
@@ -6,22 +6,75 @@ import time
 from datetime import datetime
 
 from UART import UARTMaster
+from CommandBus import CommandBus
+from CommandBus import PRIORITY_CONTROL
+from CommandBus import PRIORITY_MONITOR
+from Commands import CommandTable
+from Commands import is_ack
+from Commands import is_mon_reply
+from Commands import is_temp_reply
+from Commands import text
+from Cache import ReplyCache
 
 from Tasks import Task
-from Tasks import LinkedList
+from Tasks import TaskQueue
+from Tasks import TaskKind
 from Cycle import Cycle
 from Timer import ProgTimer
 from Timer import PyTimer
+from Timer import getScheduler
+from Telemetry import TelemetryRecorder
+from Monitor import MonitorSnapshot
+from Estimator import RampRateEstimator
+from Estimator import TargetDetector
+from Polling import AdaptivePollInterval
+from Program import CompileTaskList
+from Program import CompiledProgram
+from Program import ProgramCounter
+from Program import ProgramStatus
+from Program import ProgramStep
+from Program import ParseProgramSummary
+from Program import ParseStep
+from Journal import Journal
+from Journal import task_record
+from Journal import task_from_record
+from concurrent.futures import ThreadPoolExecutor
 import threading
 
 class SH241():
 
-    def __init__(self, address=1):
+    '''
+    bus: CommandBus of a port shared with other chambers (see BusManager). When given, the port is owned by the
+         bus manager and this handle only talks to its own address.
+    poll: Start a temperature poller thread in OpenChannel. Disabled when a BusManager polls all chambers itself.
+    port: Serial port to use instead of autodetecting one, e.g. a sim:// port (see Simulator.py). Ignored with bus.
+    cache_key: Name an autodetected port is cached under (see UARTMaster), e.g. the chamber id.
+    '''
+    def __init__(self, address=1, bus=None, poll=True, port=None, cache_key=None):
         self._address = address
-        self._instr = UARTMaster(use_rs485=False)
+        #Wire bytes of the commands sent on every poll and task transition
+        self._commands = CommandTable(address)
+        if bus is None:
+            if port is None:
+                self._instr = UARTMaster(use_rs485=False, device_address=address, cache_key=cache_key)
+            else:
+                self._instr = UARTMaster(port=port, use_rs485=False, device_address=address, autodetect=False)
+            #Every access to the port goes through the bus so the poller and control commands never interleave
+            self._bus = CommandBus(self._instr)
+        else:
+            self._instr = bus.uart
+            self._bus = bus
+        self._owns_port = bus is None
+        self._poll = poll
+        self._poller = None
         self._instr.CreateDeviceInfoList()
         self._instr.GetDeviceInfoList()
-        self._tasklist = LinkedList()
+        self._tasklist = TaskQueue()
+        #All task deadlines are kept by the shared scheduler thread. timer1 holds the pending soak/idle deadline,
+        #timer2 the pending temperature check; both are cancellable handles. The callbacks send commands, so they run
+        #on this chamber's own engine thread and a slow or dead chamber only delays itself.
+        self._scheduler = getScheduler()
+        self._engine = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chamber%i" % address)
         self.timer1 = None
         self.timer2 = None
         self.startSoaking = False
@@ -29,46 +82,117 @@ class SH241():
         self.currentCycle = 1
         self.halfCycle = 0
         #Status variables
-        self.temperature = 0
+        self.temperature = 0.0
+        self.target_temperature = 0
+        self.current_task_id = None
+        self._cycle_node = None #Queue node of the running cycle task, removed after its last cycle
+        self.recorder = None
+        self.journal = None
+        #Replies to read-only queries, so UI and engine reads between polls do not go out on the bus
+        self.reply_cache = ReplyCache()
+        #Last parsed MON?/TEMP? replies. TEMP? (set point and limits) is only read every temp_poll_every polls
+        #or after a setter changed it.
+        self.monitor = MonitorSnapshot()
+        self.temp_poll_every = 10
+        self._polls_until_temp = 0
+        #Polling speeds up while ramping towards _ramp_target and backs off otherwise; bounds are set on poll_interval
+        self.ramp_rate = RampRateEstimator()
+        self.poll_interval = AdaptivePollInterval()
+        self._ramp_target = None
+        self._poll_wakeup = threading.Event()
+        #Target counts as reached within target_detector.tolerance °C, held for target_detector.stable_seconds
+        self.target_detector = TargetDetector(tolerance=1.0, stable_seconds=0)
         self.mode = "STANDBY" #Modes: STANDBY, RAMPING, SOAKING, CYCLE_RAMPING, CYCLE_SOAKING
         self.state = "IDLE" #States: IDLE, HEATING, COOLING, SOAKING
         self.task_done = False
         self.stop_task = False
+        self.program_status = None #ProgramStatus while the controller runs the task list from program memory
+        self._program_cache = {} #Program number -> CompiledProgram last written to the controller
+        self._status_listeners = []
         
+    #Switching interface reuses the port already found instead of scanning again
     def SetRS485(self):
-        self._instr = UARTMaster(use_rs485=True)
-        self.OpenChannel()
+        self._switchInstrument(UARTMaster(port=self._instr.port, use_rs485=True, device_address=self._address, autodetect=False,
+                                          cache_key=self._instr.cache_key))
         
     def SetRS232(self):
-        self._instr = UARTMaster(use_rs485=False)
+        self._switchInstrument(UARTMaster(port=self._instr.port, use_rs485=False, device_address=self._address, autodetect=False,
+                                          cache_key=self._instr.cache_key))
+
+    #Retires the bus of the old port before opening the new one
+    def _switchInstrument(self, instr):
+        if not self._owns_port:
+            print("Error: Port is shared with other chambers. Change the interface on the BusManager instead.")
+            return
+        self._bus.Call(self._instr.Close).result()
+        self._bus.Stop()
+        self._instr = instr
+        self._bus = CommandBus(self._instr)
         self.OpenChannel()
 
+    #Runs fn(*args) on the engine thread after delay seconds
+    def _schedule(self, delay, fn, *args):
+        return self._scheduler.schedule(delay, fn, *args, executor=self._engine)
+
     def OpenChannel(self):
-        self._instr.Open()
-        self._instr.Purge()
-        self.SetModeStandby()
-        threading.Thread(target=self.tempCheckerLoop, daemon=True).start()
+        self.reply_cache.clear()
+        if self._owns_port:
+            self._bus.Call(self._instr.Open).result()
+            self._bus.Call(self._instr.Purge).result()
+        #A run journaled before a restart keeps the chamber in its current mode until ResumeFromJournal has read it;
+        #start the journal before opening the channel so it is seen here
+        if self.journal is None or self.journal.replay() is None:
+            self.SetModeStandby()
+        if self._poll and self._poller is None:
+            self._poller = threading.Thread(target=self.tempCheckerLoop, daemon=True)
+            self._poller.start()
+
+    #Sends a query and returns the reply, raising if the controller did not answer or refused it
+    def _query(self, cmd, timeout=1, priority=PRIORITY_CONTROL, validate=None):
+        return self._checkQueryReply(cmd, self._bus.Transact(cmd, timeout, priority, validate), timeout)
+
+    #Sends a setting command and returns the reply, warning if it was not acknowledged
+    def _command(self, cmd, timeout=1):
+        return self._checkCommandReply(cmd, self._bus.Transact(cmd, timeout, PRIORITY_CONTROL, is_ack), timeout)
+
+    #Sends a query that always goes out on the bus and leaves its reply in the cache for later reads
+    def _refresh(self, verb, cmd, priority=PRIORITY_CONTROL, validate=None):
+        generation = self.reply_cache.generation(verb)
+        reply = self._query(cmd, priority=priority, validate=validate)
+        self.reply_cache.put(verb, reply, generation)
+        return reply
+
+    #Replies are str, or bytes for commands sent pre-encoded from the CommandTable
+    @staticmethod
+    def _checkQueryReply(cmd, reply, timeout):
+        if reply is None:
+            raise IOError(f"No valid reply to '{text(cmd)}' within {timeout}s")
+        if reply[:3] in ('NA:', b'NA:'):
+            raise IOError(f"Controller rejected '{text(cmd)}': {text(reply)}")
+        return reply
+
+    @staticmethod
+    def _checkCommandReply(cmd, reply, timeout):
+        if reply is None:
+            print(f"Warning: no valid reply to '{text(cmd)}' within {timeout}s")
+        elif reply[:3] in ('NA:', b'NA:'):
+            print(f"Warning: controller rejected '{text(cmd)}': {text(reply)}")
+        return reply
 
     def GetType(self):
-        self._instr.Write('%i,TYPE?' % self._address)
-        time.sleep(1)   
-        self._type = self._instr.Read().strip('\r\n')
+        self._type = self.reply_cache.fetch("TYPE?", lambda: self._query('%i,TYPE?' % self._address))
         print ('Dry-bulb Sensor: %s' % self._type.split(',')[0])
         print ('Temperature Controller: %s' % self._type.split(',')[1])
         print ('Maximum Temperature: %s' % self._type.split(',')[2]) 
         return self._type
 
     def GetMode(self):
-        self._instr.Write('%i,MODE?' % self._address)
-        time.sleep(1)   
-        self._mode = self._instr.Read().strip('\r\n')
+        self._mode = self.reply_cache.fetch("MODE?", lambda: self._query('%i,MODE?' % self._address))
         print ('Mode: %s' % self._mode)
         return self._mode
 
     def GetCondition(self):
-        self._instr.Write('%i,MON?' % self._address)
-        time.sleep(1)   
-        self._cond = self._instr.Read().strip('\r\n')
+        self._cond = text(self.reply_cache.fetch("MON?", lambda: self._query('%i,MON?' % self._address, validate=is_mon_reply)))
         print ('Temperature: %s' % self._cond.split(',')[0])
         print ('Humidity: %s' % self._cond.split(',')[1])
         print ('Mode: %s' % self._cond.split(',')[2])
@@ -76,9 +200,7 @@ class SH241():
         return self._cond
         
     def GetTemp(self):
-        self._instr.Write('%i,TEMP?' % self._address)
-        time.sleep(1)   
-        self._temp = self._instr.Read().strip('\r\n')
+        self._temp = text(self.reply_cache.fetch("TEMP?", lambda: self._query('%i,TEMP?' % self._address, validate=is_temp_reply)))
         print ('Present Temperature: %s' % self._temp.split(',')[0])
         print ('Target Temperature: %s' % self._temp.split(',')[1])
         print ('High Limit Temperature: %s' % self._temp.split(',')[2])
@@ -86,113 +208,226 @@ class SH241():
         return self._temp           
     
     def GetTempSilent(self):
-        self._instr.Write('%i,TEMP?' % self._address)
-        self._instr.Purge()
-        time.sleep(1)
-        self._temp = self._instr.Read().strip('\r\n')
+        self._temp = text(self.reply_cache.fetch("TEMP?", lambda: self._query('%i,TEMP?' % self._address, priority=PRIORITY_MONITOR, validate=is_temp_reply)))
         return self._temp.split(',')[0]
          
     def SetPowerOn(self):
-        self._instr.Write('%i,POWER,ON' % self._address)  
-        time.sleep(5)   
+        self._command('%i,POWER,ON' % self._address, timeout=5)
+        self.reply_cache.invalidate("MODE?", "MON?")
          
     def SetPowerOff(self):
-        self._instr.Write('%i,POWER,OFF' % self._address)     
-        time.sleep(5)   
+        self._command('%i,POWER,OFF' % self._address, timeout=5)
+        self.reply_cache.invalidate("MODE?", "MON?")
                  
     def SetTemp(self, temp):
-        self._instr.Write('%i,TEMP,S%.1f' % (self._address, temp)) 
-        time.sleep(1)   
+        self._command(self._commands.SetTemp(temp))
+        self.reply_cache.invalidate("TEMP?")
+        self._polls_until_temp = 0
          
     def SetHighTemp(self, temp):
-        self._instr.Write('%i,TEMP,H%.1f' % (self._address, temp))  
-        time.sleep(1)   
+        self._command('%i,TEMP,H%.1f' % (self._address, temp))
+        self.reply_cache.invalidate("TEMP?")
+        self._polls_until_temp = 0
          
     def SetLowTemp(self, temp):
-        self._instr.Write('%i,TEMP,L%.1f' % (self._address, temp))  
-        time.sleep(1)   
+        self._command('%i,TEMP,L%.1f' % (self._address, temp))
+        self.reply_cache.invalidate("TEMP?")
+        self._polls_until_temp = 0
          
     def SetHumid(self, humi):
-        self._instr.Write('%i,HUMI,S%i' % (self._address, humi)) 
-        time.sleep(1)    
+        self._command('%i,HUMI,S%i' % (self._address, humi))
         
     def SetModeOff(self):
-        self._instr.Write('%i,MODE,OFF' % self._address) 
-        time.sleep(2)   
+        self._command(self._commands.MODE_OFF, timeout=2)
+        self.reply_cache.invalidate("MODE?", "MON?")
          
     def SetModeStandby(self):
-        self._instr.Write('%i,MODE,STANDBY' % self._address) 
-        time.sleep(2)       
+        self._command(self._commands.MODE_STANDBY, timeout=2)
+        self.reply_cache.invalidate("MODE?", "MON?")
          
     def SetModeConstant(self):
-        self._instr.Write('%i,MODE,CONSTANT' % self._address) 
-        time.sleep(2)   
+        self._command(self._commands.MODE_CONSTANT, timeout=2)
+        self.reply_cache.invalidate("MODE?", "MON?")
          
-    def SetModeProgram(self):
-        self._instr.Write('%i,MODE,RUN 1' % self._address)  
-        time.sleep(2)   
+    def SetModeProgram(self, program=1):
+        self._command('%i,MODE,RUN %i' % (self._address, program), timeout=2)
+        self.reply_cache.invalidate("MODE?", "MON?")
          
+    '''
+    Writes a program given as (temperature, 'TRAMPON'/'TRAMPOFF', 'HH:MM') steps, looping all steps cycles times.
+    '''
     def ProgramWrite(self, program=[(30.0, 'TRAMPON', '00:01')], cycles=1):
-        #original code
-        self._instr.Write('%i,PRGM DATA WRITE,PGM:1,EDIT START' % self._address)
-        time.sleep(1)           
-        for idx, step in enumerate(program):
-            self._instr.Write('%i,PRGM DATA WRITE,PGM:1,STEP%i,TEMP%.1f,%s,TIME%s,' % (self._address, idx+1, step[0], step[1], step[2]))
-            time.sleep(1)   
-            self._msg = ''.join(map(chr, self._instr.Read())).strip('\r\n')
-            print(self._msg)
-
-        self._instr.Write('%i,PRGM DATA WRITE,PGM:1,COUNT,(1.1.%i)' % (self._address, cycles))                       
-        time.sleep(1)   
-        self._instr.Write('%i,PRGM DATA WRITE,PGM:1,END,HOLD' % self._address)       
-        time.sleep(1)   
-        self._instr.Write('%i,PRGM DATA WRITE,PGM:1,EDIT END' % self._address)
-        time.sleep(1)   
-        #this works
-            # 1. Open the edit session
-        self.ProgramErase()
-        self._instr.Write('PRGM DATA WRITE, PGM:1, EDIT START')
-        time.sleep(0.5)
-
-        # 2. Write the step (Note: removed the trailing comma from your original string)
-        self._instr.Write('PRGM DATA WRITE, PGM:1, STEP1, TEMP12.0, TRAMPOFF, TIME02:40')
-        time.sleep(0.5)
-
-        # 3. Close and save the session
-        self._instr.Write('PRGM DATA WRITE, PGM:1, EDIT END')
-        time.sleep(0.5)
-
-        # 4. Check status
-        self._instr.Write('PRGM DATA?')
-        response = self._instr.Read()
-        print(f"Chamber Status: {response}")
-
-    def ProgramErase(self):
-        self._instr.Write('%i,PRGM ERASE,PGM:1' % self._address)
-        time.sleep(1)   
+        steps = []
+        for temp, ramp, duration in program:
+            hours, minutes = duration.split(':')
+            steps.append(ProgramStep(temp, int(hours) * 60 + int(minutes), ramp=(ramp == 'TRAMPON')))
+        counters = [ProgramCounter(1, len(steps), cycles)] if cycles > 1 else []
+        self.ProgramUpload(CompiledProgram(steps, counters))
+
+    '''
+    Writes a CompiledProgram into program number program, raising if the controller refuses a line.
+    The last program uploaded to each program number is cached (or read back from the controller once), and only
+    the steps, counters and end step that differ are rewritten. Removing steps falls back to erase and full write.
+    '''
+    def ProgramUpload(self, compiled, program=1, diff=True):
+        previous = None
+        if diff:
+            previous = self._program_cache.get(program)
+            if previous is None:
+                previous = self.ProgramRead(program)
+        commands = compiled.DiffCommands(previous, self._address, program) if previous is not None else None
+        #Forget the cached copy until the upload succeeds, so a failed upload is never diffed against
+        self._program_cache.pop(program, None)
+        if commands is None:
+            self.ProgramErase(program)
+            commands = compiled.ToCommands(self._address, program)
+        for cmd in commands:
+            self._query(cmd)
+        self._program_cache[program] = compiled.copy()
+        print(f"Program {program} uploaded: {len(compiled.steps)} steps, {compiled.TotalMinutes()} min, {len(commands)} commands sent")
+
+    #Reads program number program back from the controller, or returns None if it cannot be read
+    def ProgramRead(self, program=1):
+        try:
+            count, counters, end_mode = ParseProgramSummary(self._query('%i,PRGM DATA?,PGM:%i' % (self._address, program)))
+            steps = [ParseStep(self._query('%i,PRGM DATA?,PGM:%i,STEP%i' % (self._address, program, number)))
+                     for number in range(1, count + 1)]
+        except (IOError, ValueError) as e:
+            print(f"Could not read program {program} back: {e}")
+            return None
+        return CompiledProgram(steps, counters, end_mode=end_mode)
+
+    '''
+    Compiles the queued tasks into program memory and lets the controller run them, so execution no longer
+    depends on the host's timers. The host only polls PRGM MON? (see PollOnce) to follow progress.
+    Raises ValueError if the task list cannot be expressed as a program (see Program.CompileTaskList).
+    '''
+    def RunTaskListOnController(self, program=1):
+        compiled = CompileTaskList(self._tasklist)
+        self._cancelTimers()
+        self.ProgramUpload(compiled, program)
+        self._tasklist.clear()
+        self.stop_task = False
+        self.mode = "PROGRAM"
+        self.state = "IDLE"
+        self.program_status = None
+        if compiled.start_delay > 0:
+            self.SetModeStandby()
+            self.timer1 = self._schedule(compiled.start_delay, self._startProgram, program)
+        else:
+            self._startProgram(program)
+
+    def _startProgram(self, program):
+        if self.stop_task:
+            return
+        self.SetModeProgram(program)
+        self.state = "PROGRAM"
+        self._poll_wakeup.set()
+        self._notifyStatus()
+
+    #Follows a running program. The task list is done when the controller refuses PRGM MON? (no program running);
+    #a lost or garbled reply only means the program is checked again on the next poll.
+    def _pollProgram(self):
+        cmd = self._commands.PRGM_MON
+        reply = self._bus.Transact(cmd, 1, PRIORITY_MONITOR)
+        if reply is None:
+            print(f"Warning: no valid reply to '{text(cmd)}', still following the program")
+            return
+        if reply[:3] == b'NA:':
+            self.program_status = None
+            self.mode = "STANDBY"
+            self.state = "IDLE"
+            self.task_done = True
+            print("Program finished.")
+            return
+        try:
+            self.program_status = ProgramStatus(text(reply))
+        except ValueError as e:
+            print(f"Warning: {e}, still following the program")
+
+    def ProgramErase(self, program=1):
+        self._program_cache.pop(program, None)
+        self._command('%i,PRGM ERASE,PGM:%i' % (self._address, program))
 
     def ProgramAdvance(self):
-        self._instr.Write('%i,PRGM,ADVANCE' % self._address)                 
-        time.sleep(1)   
+        self._command('%i,PRGM,ADVANCE' % self._address)
          
     def ProgramEnd(self):
-        self._instr.Write('%i,PRGM,END,HOLD' % self._address)
-        time.sleep(1)   
+        self._command('%i,PRGM,END,HOLD' % self._address)
          
     def AddTask(self, temp, hours, minutes, seconds, taskname="Task", db_id="None"):
         if not hasattr(self, '_tasklist'):
-            self._tasklist = LinkedList()
+            self._tasklist = TaskQueue()
         task = Task(temp, hours, minutes, seconds, taskname, db_id)
         self._tasklist.enqueue(task)
         
     def AddCycle(self, temp1, temp2, hours, minutes, seconds, totalCycles, taskname="Cycle", db_id="None"):
         if not hasattr(self, '_tasklist'):
-            self._tasklist = LinkedList()
+            self._tasklist = TaskQueue()
         task = Cycle(temp1, temp2, hours, minutes, seconds, totalCycles, taskname, db_id)
         self._tasklist.enqueue(task)
         
-    def AddIdle(self, hours, minutes, seconds):
-        self.AddTask(0, hours, minutes, seconds, taskname="Idle")
+    def AddIdle(self, hours, minutes, seconds, db_id="None"):
+        self.AddTask(0, hours, minutes, seconds, taskname="Idle", db_id=db_id)
+
+    '''
+    Validates a whole profile and queues it in one call. Each entry is a dict in the format of /api/add_task:
+        {"mode": "soak", "temp": 85, "hours": 1, "minutes": 0, "seconds": 0}
+        {"mode": "cycle", "temp1": -40, "temp2": 85, "hours": 0, "minutes": 30, "seconds": 0, "cycles": 10}
+        {"mode": "idle", "hours": 0, "minutes": 5, "seconds": 0}
+    with an optional "db_id". Task/Cycle records (e.g. from ParseProfile) are queued as they are.
+    Nothing is queued unless every entry is valid; raises ValueError naming the bad entry.
+    Returns the queued Task/Cycle records.
+    '''
+    def LoadProfile(self, entries):
+        tasks = self.ParseProfile(entries)
+        for task in tasks:
+            self._tasklist.enqueue(task)
+        return tasks
+
+    #Validates profile entries (see LoadProfile) and returns them as Task/Cycle records without queueing them
+    def ParseProfile(self, entries):
+        tasks = []
+        for number, entry in enumerate(entries, start=1):
+            try:
+                tasks.append(self._taskFromEntry(entry))
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError(f"Profile entry {number}: {e}") from e
+        return tasks
+
+    def _taskFromEntry(self, entry):
+        if isinstance(entry, Task):
+            return entry
+        if not isinstance(entry, dict):
+            raise ValueError(f"expected an object, got {entry!r}")
+        mode = str(entry.get('mode', 'soak')).lower()
+        hours = int(entry.get('hours', 0))
+        minutes = int(entry.get('minutes', 0))
+        seconds = int(entry.get('seconds', 0))
+        if min(hours, minutes, seconds) < 0:
+            raise ValueError("durations cannot be negative")
+        db_id = entry.get('db_id', "None")
+        if mode in ('soak', 'task'):
+            task = Task(self._checkTemp(entry['temp']), hours, minutes, seconds, "Task", db_id)
+        elif mode == 'cycle':
+            cycles = int(entry.get('cycles', 1))
+            if cycles < 1:
+                raise ValueError("cycles must be at least 1")
+            task = Cycle(self._checkTemp(entry['temp1']), self._checkTemp(entry['temp2']), hours, minutes, seconds, cycles, "Cycle", db_id)
+        elif mode == 'idle':
+            task = Task(0, hours, minutes, seconds, "Idle", db_id)
+        else:
+            raise ValueError(f"unknown mode '{mode}'")
+        return task
+
+    #Rejects set points outside the chamber's limits (when they are known from a TEMP? reply)
+    def _checkTemp(self, temp):
+        temp = float(temp)
+        if self.monitor.high_limit is not None and temp > self.monitor.high_limit:
+            raise ValueError(f"{temp}°C is above the high limit of {self.monitor.high_limit}°C")
+        if self.monitor.low_limit is not None and temp < self.monitor.low_limit:
+            raise ValueError(f"{temp}°C is below the low limit of {self.monitor.low_limit}°C")
+        return temp
         
     '''
     Function to add an idling task to tasklist to wait till a specific datetime.
@@ -208,13 +443,30 @@ class SH241():
         seconds = total_seconds % 60
         self.AddIdle(hours, minutes, seconds)
 
-    def stopTask(self):
+    #Cancels any pending soak, idle or temperature check callbacks
+    def _cancelTimers(self):
+        if self.timer1 is not None:
+            self.timer1.cancel()
+        if self.timer2 is not None:
+            self.timer2.cancel()
         self.timer1 = None
         self.timer2 = None
+
+    def stopTask(self):
+        self._cancelTimers()
+        self._ramp_target = None
+        if self.state == "PROGRAM":
+            self.state = "IDLE"
+            self.mode = "STANDBY"
+            self.program_status = None
         self.currentCycle = 1
         self.halfCycle = 0
         self.stop_task = True
+        #A stopped run is not resumed
+        if self.journal is not None:
+            self.journal.clear()
         self.SetModeStandby()
+        self._notifyStatus()
         print("Task stopped. Clearing timers and putting chamber in Standby.")
         if not self._tasklist.head:
             self.SetModeStandby()
@@ -222,23 +474,25 @@ class SH241():
             return
     
     def startNextTask(self):
+        self._journal("half_done" if self.mode == "CYCLE" else "done", cycle=self.currentCycle, half=self.halfCycle)
         if (self.mode != "CYCLE"):
             self.task_done = True
         self.startTask()
     
     def startTask(self):
         #Cancel existing timers
-        self.timer1 = None
-        self.timer2 = None
+        self._cancelTimers()
         
-        if not self._tasklist.head:
+        #Takes the current task to execute; a cycle task stays queued until its last cycle is done
+        node = self._tasklist.pop_head(keep=lambda task: task.kind is TaskKind.CYCLE)
+        if node is None:
+            if self.journal is not None:
+                self.journal.clear()
             self.SetModeStandby()
             print("All tasks completed. Putting chamber in Standby.")
             return
-
-        #Pops the current task to execute
-        node = self._tasklist.head
         task = node.data
+        self.current_task_id = task.db_id
         
         #Converting total seconds to hours, minutes and seconds
         hours = task.durationInSeconds // 3600
@@ -247,19 +501,19 @@ class SH241():
         
         self.stop_task = False
         #For task
-        if (task.taskName == "Task"):
-            self._tasklist.pop_head()
+        if (task.kind is TaskKind.TASK):
             print(f"Starting {task.taskName}: Soak at {task.temp}°C for {hours}hr {minutes}min {seconds}s")
+            self._journalStep(task, target=task.temp)
             self.startTemperatureSoak(task.temp, task.durationInSeconds)
         #For Idling process
-        elif (task.taskName == "Idle"):
-            self._tasklist.pop_head()
+        elif (task.kind is TaskKind.IDLE):
             print(f"Idling for {hours}hr {minutes}min {seconds}s")
             self.SetModeStandby()
+            self._ramp_target = None
             durationInSeconds = hours*3600 + minutes*60 + seconds
+            self._journalStep(task, deadline=time.time() + durationInSeconds)
             try:
-                self.timer1 = threading.Timer(durationInSeconds, self.startTask)
-                self.timer1.start()
+                self.timer1 = self._schedule(durationInSeconds, self.startTask)
             except Exception as e:
                 print(f"CRASHED while setting timer: {e}")
         #For Cycling process
@@ -267,6 +521,7 @@ class SH241():
             #Half cycle refers to the period where temperature goes to either temp1 or temp2 and soaks
             #Full cycle is the process of soaking at both temperatures for one entire duration
             self.state = "CYCLE"
+            self._cycle_node = node
             if (self.halfCycle >= 2):
                 self.currentCycle += 1
                 self.halfCycle = 0
@@ -277,6 +532,7 @@ class SH241():
                 print(f"Starting cycle {self.currentCycle}: Soak at {task.temp2}°C for {hours}hr {minutes}min {seconds}s")
                 self.startCycle(self.currentCycle, task.totalCycles, task.temp1, task.temp2, hours, minutes, seconds, state=1)
             self.halfCycle += 1
+        self._notifyStatus()
     
     '''
     Function to start cycle based on state
@@ -289,7 +545,10 @@ class SH241():
     '''
     def startCycle(self, currentCycle, totalCycles, temp1, temp2, hours, minutes, seconds, state=0):
         if (currentCycle > totalCycles):
-            self._tasklist.pop_head()
+            self._journal("done", cycle=currentCycle, half=self.halfCycle)
+            if self._cycle_node is not None:
+                self._tasklist.remove(self._cycle_node)
+                self._cycle_node = None
             self.currentCycle = 1
             self.halfCycle = 0
             self.task_done = True
@@ -297,6 +556,8 @@ class SH241():
             return
         self.mode = "CYCLE"
         durationInSeconds = hours * 3600 + minutes * 60 + seconds
+        #halfCycle is advanced by startTask after this returns, so the half starting now is state + 1
+        self._journalStep(self._cycle_node.data, target=temp2 if state else temp1, half=state + 1)
         if (state == 0):
             print(f"Starting cycle {self.currentCycle}: Soak at {temp1}°C for {hours}hr {minutes}min {seconds}s")
             self.startTemperatureSoak(temp1, durationInSeconds)
@@ -304,12 +565,154 @@ class SH241():
             self.startTemperatureSoak(temp2, durationInSeconds)
             print(f"Starting cycle {self.currentCycle}: Soak at {temp2}°C for {hours}hr {minutes}min {seconds}s")
     
-    #Loop that reads temperature every 3 seconds
+    #Reads the chamber once and updates the status variables
+    '''
+    One MON? gives temperature, humidity, mode and alarms; TEMP? is added only when the set point may have changed.
+    The parsed values are published as a new MonitorSnapshot in self.monitor.
+    '''
+    def PollOnce(self):
+        monitor = self.monitor.copy()
+        monitor.UpdateFromMon(self._refresh("MON?", self._commands.MON, priority=PRIORITY_MONITOR, validate=is_mon_reply))
+        if self._polls_until_temp <= 0:
+            monitor.UpdateFromTemp(self._refresh("TEMP?", self._commands.TEMP, priority=PRIORITY_MONITOR, validate=is_temp_reply))
+            self._polls_until_temp = self.temp_poll_every
+        self._polls_until_temp -= 1
+        self.monitor = monitor
+        self.temperature = monitor.temperature
+        self.ramp_rate.update(monitor.timestamp, monitor.temperature)
+        if monitor.target_temperature is not None:
+            self.target_temperature = monitor.target_temperature
+        if self.state == "PROGRAM":
+            self._pollProgram()
+        if self.recorder is not None:
+            self._recordTelemetry()
+        self._notifyStatus()
+
+    #Starts saving every poll to a new telemetry run file in directory (see Telemetry.py)
+    def StartRecording(self, directory, **kwargs):
+        self.StopRecording()
+        self.recorder = TelemetryRecorder(directory, name=kwargs.pop('name', 'chamber%i' % self._address), **kwargs)
+
+    def StopRecording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def _recordTelemetry(self):
+        task_id = self.current_task_id if isinstance(self.current_task_id, int) else None
+        try:
+            self.recorder.record(self.temperature, self.target_temperature, self.state, task_id,
+                                 self.currentCycle, self.halfCycle)
+        except Exception as e:
+            print(f"Error recording telemetry: {e}")
+
+    #Starts journaling task progress to path so the run can be resumed after a restart (see Journal.py)
+    def StartJournal(self, path, **kwargs):
+        self.StopJournal()
+        self.journal = Journal(path, **kwargs)
+
+    #Closes the journal without clearing it, so the run can still be resumed
+    def StopJournal(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def _journal(self, event, **fields):
+        if self.journal is not None:
+            try:
+                self.journal.append(event, **fields)
+            except Exception as e:
+                print(f"Error writing journal: {e}")
+
+    #Compacts the journal to the step that is starting
+    def _journalStep(self, task, target=None, deadline=None, half=None):
+        if self.journal is not None:
+            try:
+                self.journal.begin("step", task=task_record(task), cycle=self.currentCycle,
+                                   half=self.halfCycle if half is None else half, target=target,
+                                   duration=task.durationInSeconds, deadline=deadline)
+            except Exception as e:
+                print(f"Error writing journal: {e}")
+
+    '''
+    Continues the run recorded in the journal after a restart. Queue the remaining tasks first; a cycle that was in
+    progress is put back at the head of the queue. The chamber is read once, then the step carries on where it was:
+    a ramp restarts towards its target, a soak or idle waits out the time left until its deadline, and a finished
+    step moves on to the next task. Returns the replayed run (see Journal.replay), or None if there was nothing to resume.
+    '''
+    def ResumeFromJournal(self):
+        run = self.journal.replay() if self.journal is not None else None
+        if run is None:
+            return None
+        try:
+            self.PollOnce()
+        except Exception as e:
+            print(f"Error occurred while checking temperature: {e}")
+        task = task_from_record(run["task"])
+        phase = run["phase"]
+        self._cancelTimers()
+        self.current_task_id = task.db_id
+        self.stop_task = False
+        if task.kind is TaskKind.CYCLE and phase != "done":
+            self._tasklist.push_head(task)
+            self.mode = "CYCLE"
+            self.state = "CYCLE"
+            self.currentCycle = run["cycle"]
+            self.halfCycle = run["half"]
+        print(f"Resuming {task.taskName} (DB ID {task.db_id}) from the journal: {phase}")
+        if phase == "done":
+            self.task_done = True
+            self.startTask()
+        elif phase == "half_done":
+            self.startTask()
+        elif phase == "idle":
+            self.SetModeStandby()
+            self.timer1 = self._schedule(max(0, run["deadline"] - time.time()), self.startTask)
+        elif phase == "soak":
+            #The chamber kept running while the process was down; only command it if it no longer holds the target
+            if self.monitor.mode != "CONSTANT" or self.target_temperature != run["target"]:
+                self.SetTemp(run["target"])
+                self.SetModeConstant()
+            self.state = "SOAKING"
+            remaining = max(0, run["deadline"] - time.time())
+            print(f"Soak at {run['target']}°C continues for {remaining:.0f}s.")
+            self.timer1 = self._schedule(remaining, self.startNextTask)
+        else:
+            self.startTemperatureSoak(run["target"], run["duration"])
+        self._notifyStatus()
+        return run
+
+    #Command metrics of this chamber's port with the labels that identify it, as a source for Metrics.PrometheusText
+    def GetCommandMetrics(self):
+        return self._instr.metrics, {"port": self._instr.port}
+
+    #Registers fn() to be called whenever a poll or the task engine updates the status variables
+    def AddStatusListener(self, fn):
+        self._status_listeners.append(fn)
+
+    def RemoveStatusListener(self, fn):
+        if fn in self._status_listeners:
+            self._status_listeners.remove(fn)
+
+    def _notifyStatus(self):
+        for listener in list(self._status_listeners):
+            try:
+                listener()
+            except Exception as e:
+                print(f"Error in status listener: {e}")
+
+    #Seconds to wait before the next poll, based on how close a ramp is to its target
+    def NextPollInterval(self):
+        return self.poll_interval.next(self.temperature, self._ramp_target, self.ramp_rate)
+
+    #Loop that reads temperature at the adaptive poll interval
     def tempCheckerLoop(self):
         while True:
             try:
-                time.sleep(3.0) # Pauses this specific thread for 3 seconds
-                self.temperature = self.GetTempSilent()
+                #Starting a ramp wakes the loop early instead of waiting out a long idle interval
+                self._poll_wakeup.wait(self.NextPollInterval())
+                self._poll_wakeup.clear()
+                self.PollOnce()
             except Exception as e:
                 print(f"Error occurred while checking temperature: {e}")
 
@@ -319,61 +722,76 @@ class SH241():
             print("List is empty.")
             return
 
-        current = self._tasklist.head
-        previous = None
+        if self._tasklist.delete(target_db_id):
+            print(f"Successfully deleted Task with DB ID {target_db_id}")
+        else:
+            print(f"Task with DB ID {target_db_id} was not found in the Oven.")
 
-        #Loop through the whole list
-        while current:
-            #Check for matching id
-            if current.data.db_id == target_db_id:
-                
-                if previous is None:
-                    #Case: Deleting the very first item (Head)
-                    self._tasklist.head = current.next
-                else:
-                    #Case: Deleting a middle or last item
-                    previous.next = current.next
-                
-                print(f"Successfully deleted Task with DB ID {target_db_id}")
-                return
-
-            previous = current
-            current = current.next
-        #Exiting while loop means id not found
-        print(f"Task with DB ID {target_db_id} was not found in the Oven.")
+    #Moves a queued task in front of another one (or to the end of the queue if before_db_id is None)
+    def moveTask(self, db_id, before_db_id=None):
+        if not self._tasklist.move(db_id, before_db_id):
+            print(f"Could not move Task with DB ID {db_id}.")
+            return False
+        return True
         
 
-    #Queries the temperature at intervals of 3 seconds and sets a timer once it reaches target
-    def temperatureQuerySchedule(self, target, durationInSeconds):
+    #Queries the temperature after delay seconds (default: the adaptive poll interval) and sets a timer once it reaches target
+    def temperatureQuerySchedule(self, target, durationInSeconds, delay=None):
         if self.stop_task:
             return
-        self.timer2 = threading.Timer(3.0, self.checkTempCallback, args=[target, durationInSeconds])
-        self.timer2.start()
+        if delay is None:
+            delay = self.NextPollInterval()
+        self.timer2 = self._schedule(delay, self.checkTempCallback, target, durationInSeconds)
+
+    '''
+    Seconds until the next target check: when the reading is predicted to enter the tolerance band, or when it will
+    have been in the band for stable_seconds, bounded by the poll interval limits.
+    '''
+    def _nextTargetCheck(self, timestamp):
+        temperature = self.temperature
+        if self.target_detector.inBand(temperature):
+            delay = self.target_detector.remainingStableTime(timestamp)
+        else:
+            delay = self.target_detector.timeToBand(temperature, self.ramp_rate)
+            if delay is None:
+                delay = self.NextPollInterval()
+        return min(self.poll_interval.max_interval, max(self.poll_interval.min_interval, delay))
         
 
-    #Function called every 3 seconds to check temperature
+    #Function called when the target is expected to be reached (or at the poll interval) to check temperature
     #Sets a timer for a certain duration after timer has reached target temperature
     #Then sets chamber to standby after timer ends
     def checkTempCallback(self, target, durationInSeconds):
-        
+        if self.stop_task:
+            return
         hours = durationInSeconds // 3600
         minutes = (durationInSeconds % 3600) // 60
         seconds = durationInSeconds % 60
+        #The check may fire at a predicted crossing between polls, so read the chamber if the last sample is stale
+        if self.monitor.timestamp is None or time.time() - self.monitor.timestamp > self.poll_interval.min_interval:
+            try:
+                self.PollOnce()
+            except Exception as e:
+                print(f"Error occurred while checking temperature: {e}")
+        timestamp = self.monitor.timestamp if self.monitor.timestamp is not None else time.time()
         #When target temperature is reached, start soaking for specified duration
-        if abs(float(self.temperature) - target) <= 1:
+        if self.target_detector.update(timestamp, self.temperature):
             dateTime = datetime.now()
             self.state = "SOAKING"  # Indicate soaking state started
+            self._ramp_target = None
             print(f"Target {target}°C Reached at {dateTime}. Starting Soak for {hours}hr {minutes}min {seconds}s.")
+            self._journal("reached", reached=timestamp, deadline=timestamp + durationInSeconds)
             try:
-                self.timer1 = threading.Timer(durationInSeconds, self.startNextTask)
-                self.timer1.start()
+                self.timer1 = self._schedule(durationInSeconds, self.startNextTask)
             except Exception as e:
                 print(f"CRASHED while setting timer: {e}")
         else:
-            #Target missed. Schedule the next check.
-            self.temperatureQuerySchedule(target, durationInSeconds)
-            self.state = "HEATING" if float(self.temperature) < target else "COOLING"
-            print(f"Target Temperature= {target}°C, Current Temperature= {self.temperature}°C, rechecking in 3 seconds.")
+            #Target missed. Schedule the next check for when it is expected to be reached.
+            delay = self._nextTargetCheck(timestamp)
+            self.temperatureQuerySchedule(target, durationInSeconds, delay)
+            self.state = "HEATING" if self.temperature < target else "COOLING"
+            print(f"Target Temperature= {target}°C, Current Temperature= {self.temperature}°C, rechecking in {delay:.1f} seconds.")
+        self._notifyStatus()
             
     #Sets the oven to soak at a target temperature for a specified duration
     def startTemperatureSoak(self, target_temp, durationInSeconds):
@@ -381,6 +799,10 @@ class SH241():
             return
         self.SetTemp(target_temp)
         self.SetModeConstant()
+        self._ramp_target = target_temp
+        self.ramp_rate.reset()
+        self.target_detector.start(target_temp)
+        self._poll_wakeup.set()
         self.temperatureQuerySchedule(target_temp, durationInSeconds)
         
     def returnToAmbient(self):
@@ -391,5 +813,6 @@ class SH241():
         self._tasklist.print_list()
 
     def CloseChannel(self):
-        self._instr.Close()
+        if self._owns_port:
+            self._bus.Call(self._instr.Close).result()
          
@@ -0,0 +1,90 @@
+'''Estimator.py: Online estimate of the chamber's ramp rate and detection of the moment a ramp reaches its target.
+'''
+
+from collections import deque
+
+'''
+Ramp rate in °C per second, from a least-squares line through the samples of the last window seconds.
+A line fit is far less sensitive to single noisy readings than the difference of two samples.
+'''
+class RampRateEstimator:
+    def __init__(self, window=60.0):
+        self.window = window
+        self.rate = None
+        self._samples = deque()
+
+    def reset(self):
+        self.rate = None
+        self._samples.clear()
+
+    def update(self, timestamp, temperature):
+        if self._samples and timestamp <= self._samples[-1][0]:
+            return
+        self._samples.append((timestamp, temperature))
+        while len(self._samples) > 2 and timestamp - self._samples[0][0] > self.window:
+            self._samples.popleft()
+        n = len(self._samples)
+        if n < 2:
+            self.rate = None
+            return
+        #Times are taken relative to the oldest sample to keep the sums well conditioned
+        t0 = self._samples[0][0]
+        sum_t = sum_y = sum_tt = sum_ty = 0.0
+        for t, y in self._samples:
+            t -= t0
+            sum_t += t
+            sum_y += y
+            sum_tt += t * t
+            sum_ty += t * y
+        denominator = n * sum_tt - sum_t * sum_t
+        self.rate = (n * sum_ty - sum_t * sum_y) / denominator if denominator else None
+
+    #Seconds until target is reached at the current rate, or None if the chamber is not moving towards it
+    def timeToTarget(self, temperature, target):
+        if self.rate is None or self.rate == 0:
+            return None
+        eta = (target - temperature) / self.rate
+        return eta if eta >= 0 else None
+
+'''
+Decides when a ramp has reached its target: the temperature has to be within tolerance of the target and stay
+there for stable_seconds (0 declares the target reached on the first reading inside the band).
+'''
+class TargetDetector:
+    def __init__(self, tolerance=1.0, stable_seconds=0):
+        self.tolerance = tolerance
+        self.stable_seconds = stable_seconds
+        self.target = None
+        self._in_band_since = None
+
+    def start(self, target):
+        self.target = target
+        self._in_band_since = None
+
+    def inBand(self, temperature):
+        return abs(temperature - self.target) <= self.tolerance
+
+    #Feeds one reading and returns True once the target counts as reached
+    def update(self, timestamp, temperature):
+        if not self.inBand(temperature):
+            self._in_band_since = None
+            return False
+        if self._in_band_since is None:
+            self._in_band_since = timestamp
+        return timestamp - self._in_band_since >= self.stable_seconds
+
+    #Seconds the temperature still has to stay in the band (0 if outside the band or already stable)
+    def remainingStableTime(self, timestamp):
+        if self._in_band_since is None:
+            return 0
+        return max(0, self.stable_seconds - (timestamp - self._in_band_since))
+
+    '''
+    Predicted seconds until the reading enters the band, using the ramp rate estimator.
+    Returns None if the chamber is not heading towards the target.
+    '''
+    def timeToBand(self, temperature, estimator):
+        if self.inBand(temperature):
+            return 0
+        edge = self.target - self.tolerance if temperature < self.target else self.target + self.tolerance
+        return estimator.timeToTarget(temperature, edge)
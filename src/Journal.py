@@ -0,0 +1,136 @@
+'''Journal.py: Append-only journal of the task engine's progress, so a run can continue after the host process dies.
+Each line is one JSON event:
+    {"event": "step", "t": ..., "task": {...}, "cycle": 1, "half": 1, "target": 85.0, "duration": 3600, "deadline": null}
+        A task, cycle half or idle (deadline set, no target) started.
+    {"event": "reached", "t": ..., "reached": ..., "deadline": ...}
+        The target was reached; the soak ends at deadline (unix seconds).
+    {"event": "half_done", "t": ..., "cycle": 1, "half": 1}
+    {"event": "done", "t": ..., "cycle": 1, "half": 2}
+Starting a step compacts the file down to that step's event, so it never holds more than a few lines and replaying
+it takes the same time on day five of a run as on the first minute.
+
+Lines reach the OS as soon as they are appended, which survives the process dying. fsync, which also survives a
+power cut, is batched: every sync_every events or sync_interval seconds after a write, whichever comes first.
+Compactions are synced immediately because they replace the file.
+'''
+
+import json
+import os
+import threading
+import time
+
+from Tasks import Task
+from Tasks import TaskKind
+from Cycle import Cycle
+from Timer import getScheduler
+
+class Journal:
+    def __init__(self, path, sync_every=16, sync_interval=1.0):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._sync_call = None
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def append(self, event, **fields):
+        fields["event"] = event
+        fields.setdefault("t", time.time())
+        with self._lock:
+            self._file.write(json.dumps(fields) + "\n")
+            self._file.flush()
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every:
+                self._sync()
+            elif self._sync_call is None:
+                self._sync_call = getScheduler().schedule(self.sync_interval, self.sync)
+
+    #Replaces the journal with the event of a new step
+    def begin(self, event, **fields):
+        fields["event"] = event
+        fields.setdefault("t", time.time())
+        self._rewrite([fields])
+
+    #Empties the journal once there is nothing left to resume
+    def clear(self):
+        self._rewrite([])
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            self._file.close()
+
+    #Events in the order they were written. A line cut short by a crash ends the journal.
+    def read(self):
+        events = []
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:
+                        break
+        except FileNotFoundError:
+            pass
+        return events
+
+    '''
+    Folds the journal into the state of the run it describes, or None if there is nothing to resume.
+    Returns the step event plus "phase": "ramp" (target not reached yet), "soak" (with "reached" and "deadline"),
+    "idle" (with "deadline"), "half_done" or "done".
+    '''
+    def replay(self):
+        run = None
+        for event in self.read():
+            kind = event.get("event")
+            if kind == "step":
+                run = dict(event, phase="idle" if event.get("deadline") is not None else "ramp")
+            elif run is None:
+                continue
+            elif kind == "reached":
+                run.update(phase="soak", reached=event["reached"], deadline=event["deadline"])
+            elif kind == "half_done" and run["phase"] != "done":
+                run["phase"] = "half_done"
+            elif kind == "done":
+                run["phase"] = "done"
+        return run
+
+    def _sync(self):
+        if self._sync_call is not None:
+            self._sync_call.cancel()
+            self._sync_call = None
+        if self._unsynced and not self._file.closed:
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    #Writes events to a temporary file and swaps it in, so a crash leaves either the old or the new journal
+    def _rewrite(self, events):
+        temporary = self.path + ".tmp"
+        with self._lock:
+            with open(temporary, 'w', encoding='utf-8') as f:
+                f.writelines(json.dumps(event) + "\n" for event in events)
+                f.flush()
+                os.fsync(f.fileno())
+            self._file.close()
+            os.replace(temporary, self.path)
+            self._file = open(self.path, 'a', encoding='utf-8')
+            self._unsynced = 0
+
+#Journal form of a Task/Cycle record
+def task_record(task):
+    record = {"kind": task.kind.value, "temp": task.temp, "duration": task.durationInSeconds, "db_id": task.db_id}
+    if task.kind is TaskKind.CYCLE:
+        record.update(temp1=task.temp1, temp2=task.temp2, cycles=task.totalCycles)
+    return record
+
+def task_from_record(record):
+    if record["kind"] == TaskKind.CYCLE.value:
+        return Cycle(record["temp1"], record["temp2"], 0, 0, record["duration"], record["cycles"], "Cycle", record["db_id"])
+    return Task(record["temp"], 0, 0, record["duration"], record["kind"], record["db_id"])
@@ -0,0 +1,140 @@
+'''Metrics.py: Latency histograms and counters for serial commands and web requests, exported in the Prometheus
+text format by /api/metrics. Each MetricSet keeps one histogram and a few counters per key (e.g. per command verb).
+'''
+
+import bisect
+import threading
+
+#Bucket upper bounds in seconds, 25% apart from 1 ms to about 11 s, so percentiles are accurate to a few percent
+BUCKETS = tuple(round(0.001 * 1.25 ** n, 6) for n in range(42))
+
+class LatencyHistogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def copy(self):
+        histogram = LatencyHistogram(self.buckets)
+        histogram.merge(self)
+        return histogram
+
+    #Estimated q-th quantile (0..1) in seconds, interpolated inside the bucket it falls in
+    def percentile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = self.buckets[i - 1] if i > 0 else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return low + (high - low) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+class MetricSet:
+    '''
+    prefix: Name of the histogram, e.g. "espec_command_duration_seconds". Counters are named
+            "<prefix without _duration_seconds>_<counter>_total".
+    key_label: Label the series are split by, e.g. "verb".
+    description: Help text of the histogram.
+    counters: {counter name: help text} of the counters kept per key.
+    '''
+    def __init__(self, prefix, key_label, description, counters=None):
+        self.prefix = prefix
+        self.key_label = key_label
+        self.description = description
+        self.counter_help = dict(counters or {})
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, key, seconds):
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    def increment(self, key, counter, amount=1):
+        with self._lock:
+            counters = self._counters.setdefault(key, {})
+            counters[counter] = counters.get(counter, 0) + amount
+
+    #Copies of the histograms by key
+    def histograms(self):
+        with self._lock:
+            return {key: histogram.copy() for key, histogram in self._histograms.items()}
+
+    #Copies of the counters by key
+    def counters(self):
+        with self._lock:
+            return {key: dict(counters) for key, counters in self._counters.items()}
+
+    #All keys merged into one histogram
+    def total(self):
+        total = LatencyHistogram()
+        for histogram in self.histograms().values():
+            total.merge(histogram)
+        return total
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+def _labels(labels):
+    return '{' + ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for name, value in labels.items()) + '}'
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+'''
+Renders metric sets in the Prometheus text exposition format. sources is a list of (MetricSet, labels) pairs;
+sets sharing a prefix (e.g. one per serial port) are written as one metric family told apart by labels.
+'''
+def PrometheusText(sources):
+    families = {}
+    for metrics, labels in sources:
+        families.setdefault(metrics.prefix, []).append((metrics, labels))
+    lines = []
+    for prefix, members in families.items():
+        first = members[0][0]
+        lines.append('# HELP %s %s' % (prefix, first.description))
+        lines.append('# TYPE %s histogram' % prefix)
+        for metrics, labels in members:
+            for key, histogram in sorted(metrics.histograms().items()):
+                series = dict(labels, **{metrics.key_label: key})
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append('%s_bucket%s %i' % (prefix, _labels(dict(series, le=repr(bound))), cumulative))
+                lines.append('%s_bucket%s %i' % (prefix, _labels(dict(series, le='+Inf')), histogram.count))
+                lines.append('%s_sum%s %s' % (prefix, _labels(series), _number(histogram.sum)))
+                lines.append('%s_count%s %i' % (prefix, _labels(series), histogram.count))
+        base = prefix[:-len('_duration_seconds')] if prefix.endswith('_duration_seconds') else prefix
+        for counter, description in first.counter_help.items():
+            name = '%s_%s_total' % (base, counter)
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s counter' % name)
+            for metrics, labels in members:
+                for key, counters in sorted(metrics.counters().items()):
+                    lines.append('%s%s %i' % (name, _labels(dict(labels, **{metrics.key_label: key})), counters.get(counter, 0)))
+    return '\n'.join(lines) + '\n'
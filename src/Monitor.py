@@ -0,0 +1,88 @@
+'''Monitor.py: Parsed view of the chamber's monitor replies.
+A MonitorSnapshot is filled from MON? (temperature, humidity, mode, alarms) on every poll and from TEMP?
+(set point and limits) on a slower cadence, so status readers get typed values from memory instead of the port.
+'''
+
+import time
+
+#Converts a reply field to float, returning None for fields the chamber leaves blank (e.g. humidity on temp-only models)
+def _toFloat(field):
+    #Blank fields are checked up front; raising and catching ValueError costs more than the whole conversion
+    if not field or field.isspace():
+        return None
+    try:
+        return float(field)
+    except ValueError:
+        return None
+
+#Mode names decoded once per distinct reply field
+_modes = {}
+
+def _toText(field):
+    if not isinstance(field, bytes):
+        return field.strip()
+    text = _modes.get(field)
+    if text is None:
+        text = field.decode('ascii', errors='replace').strip()
+        if len(_modes) < 64:
+            _modes[field] = text
+    return text
+
+#Replies are parsed as str or, when the command was sent pre-encoded (see Commands.py), straight from the bytes
+def _fields(reply):
+    return reply.split(b',' if isinstance(reply, bytes) else ',')
+
+class MonitorSnapshot:
+    def __init__(self):
+        #From MON?
+        self.temperature = None
+        self.humidity = None
+        self.mode = None
+        self.alarms = 0
+        self.timestamp = None
+        #From TEMP?
+        self.target_temperature = None
+        self.high_limit = None
+        self.low_limit = None
+        self.temp_timestamp = None
+
+    def copy(self):
+        snapshot = MonitorSnapshot()
+        snapshot.__dict__.update(self.__dict__)
+        return snapshot
+
+    #Reply to MON?: "temperature,humidity,mode,number of alarms"
+    def UpdateFromMon(self, reply):
+        fields = _fields(reply)
+        if len(fields) < 4:
+            raise ValueError(f"Unexpected MON? reply: {reply}")
+        temperature = _toFloat(fields[0])
+        if temperature is None:
+            raise ValueError(f"Unexpected MON? reply: {reply}")
+        self.temperature = temperature
+        self.humidity = _toFloat(fields[1])
+        self.mode = _toText(fields[2])
+        self.alarms = int(fields[3]) if fields[3].strip().isdigit() else 0
+        self.timestamp = time.time()
+
+    #Reply to TEMP?: "present,target,high limit,low limit"
+    def UpdateFromTemp(self, reply):
+        fields = _fields(reply)
+        if len(fields) < 4:
+            raise ValueError(f"Unexpected TEMP? reply: {reply}")
+        self.target_temperature = _toFloat(fields[1])
+        self.high_limit = _toFloat(fields[2])
+        self.low_limit = _toFloat(fields[3])
+        self.temp_timestamp = time.time()
+
+    def ToDict(self):
+        return {
+            "temperature": self.temperature,
+            "humidity": self.humidity,
+            "mode": self.mode,
+            "alarms": self.alarms,
+            "target_temperature": self.target_temperature,
+            "high_limit": self.high_limit,
+            "low_limit": self.low_limit,
+            "timestamp": self.timestamp,
+        }
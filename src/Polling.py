@@ -0,0 +1,27 @@
+'''Polling.py: Chooses how long to wait before the next chamber poll based on the control phase.
+While ramping, polls get faster as the estimated time to the set point shrinks; during soaks, idles and standby
+they back off to the maximum interval.
+'''
+
+class AdaptivePollInterval:
+    '''
+    min_interval, max_interval: Bounds of the poll interval in seconds.
+    default_interval: Interval used while ramping before a ramp rate is known.
+    approach_fraction: Fraction of the remaining time to target waited before the next poll.
+    '''
+    def __init__(self, min_interval=0.5, max_interval=10.0, default_interval=3.0, approach_fraction=0.25):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.default_interval = default_interval
+        self.approach_fraction = approach_fraction
+
+    #target is the set point being ramped to, or None when no ramp is in progress
+    def next(self, temperature, target, estimator):
+        if target is None:
+            return self.max_interval
+        if temperature is None:
+            return self.default_interval
+        eta = estimator.timeToTarget(temperature, target)
+        if eta is None:
+            return self.default_interval
+        return min(self.max_interval, max(self.min_interval, eta * self.approach_fraction))
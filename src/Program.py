@@ -0,0 +1,176 @@
+'''Program.py: Compiles the task list into a program for the chamber controller's built-in program memory.
+Once uploaded and started with MODE,RUN the controller executes every step and loop itself, and the host only has to
+poll PRGM MON? for progress.
+
+Differences from the host-driven engine:
+- Step times run from the start of the step, so they include the ramp to the step's temperature.
+- Durations are rounded up to whole minutes; steps longer than MAX_STEP_MINUTES are split.
+- Idle tasks (standby) only exist at the start of the list, where they become a start delay before MODE,RUN.
+'''
+
+import copy
+import re
+
+from Tasks import TaskKind
+
+MAX_STEP_MINUTES = 99 * 60 + 59
+MAX_COUNTERS = 2
+COUNTER_NAMES = "AB"
+
+class ProgramStep:
+    def __init__(self, temp, minutes, ramp=False):
+        self.temp = float(temp)
+        self.minutes = int(minutes)
+        self.ramp = ramp
+
+    def __eq__(self, other):
+        return isinstance(other, ProgramStep) and (self.temp, self.minutes, self.ramp) == (other.temp, other.minutes, other.ramp)
+
+    def __repr__(self):
+        return f"ProgramStep({self.temp}, {self.minutes}, ramp={self.ramp})"
+
+    #Step parameters as sent to the controller, e.g. "TEMP25.0,TRAMPOFF,TIME1:30"
+    def ToParameters(self):
+        return 'TEMP%.1f,%s,TIME%i:%02i' % (self.temp, 'TRAMPON' if self.ramp else 'TRAMPOFF', self.minutes // 60, self.minutes % 60)
+
+#Repeats steps first..last (1-based, inclusive) repeats times
+class ProgramCounter:
+    def __init__(self, first, last, repeats):
+        self.first = first
+        self.last = last
+        self.repeats = repeats
+
+    def __eq__(self, other):
+        return isinstance(other, ProgramCounter) and (self.first, self.last, self.repeats) == (other.first, other.last, other.repeats)
+
+    def __repr__(self):
+        return f"ProgramCounter({self.first}, {self.last}, {self.repeats})"
+
+class CompiledProgram:
+    def __init__(self, steps=None, counters=None, start_delay=0, end_mode='HOLD'):
+        self.steps = steps if steps is not None else []
+        self.counters = counters if counters is not None else []
+        #Seconds to wait (in standby) before starting the program
+        self.start_delay = start_delay
+        self.end_mode = end_mode
+
+    #Total running time in minutes including loops
+    def TotalMinutes(self):
+        total = sum(step.minutes for step in self.steps)
+        for counter in self.counters:
+            total += (counter.repeats - 1) * sum(step.minutes for step in self.steps[counter.first - 1:counter.last])
+        return total
+
+    def copy(self):
+        return copy.deepcopy(self)
+
+    '''
+    Commands that turn previous (the program already in the controller) into this one: only changed or new steps,
+    plus the loop counters and end step if they changed. Returns None when a full rewrite is needed because steps
+    or counters were removed, which cannot be expressed as an edit.
+    '''
+    def DiffCommands(self, previous, address, program=1):
+        if len(self.steps) < len(previous.steps) or (previous.counters and not self.counters):
+            return None
+        prefix = '%i,PRGM DATA WRITE,PGM:%i' % (address, program)
+        commands = []
+        for number, step in enumerate(self.steps, start=1):
+            if number > len(previous.steps) or previous.steps[number - 1] != step:
+                commands.append('%s,STEP%i,%s' % (prefix, number, step.ToParameters()))
+        if self.counters != previous.counters:
+            commands.extend(self.CounterCommands(address, program))
+        if len(self.steps) != len(previous.steps) or self.end_mode != previous.end_mode:
+            commands.append('%s,END,%s' % (prefix, self.end_mode))
+        if not commands:
+            return []
+        return ['%s,EDIT START' % prefix] + commands + ['%s,EDIT END' % prefix]
+
+    #Commands that write this program into program number program of the chamber at address, in order
+    def ToCommands(self, address, program=1):
+        prefix = '%i,PRGM DATA WRITE,PGM:%i' % (address, program)
+        commands = ['%s,EDIT START' % prefix]
+        for number, step in enumerate(self.steps, start=1):
+            commands.append('%s,STEP%i,%s' % (prefix, number, step.ToParameters()))
+        commands.extend(self.CounterCommands(address, program))
+        commands.append('%s,END,%s' % (prefix, self.end_mode))
+        commands.append('%s,EDIT END' % prefix)
+        return commands
+
+    def CounterCommands(self, address, program=1):
+        if not self.counters:
+            return []
+        counters = ','.join('%s(%i.%i.%i)' % (COUNTER_NAMES[n], c.first, c.last, c.repeats) for n, c in enumerate(self.counters))
+        return ['%i,PRGM DATA WRITE,PGM:%i,COUNT,%s' % (address, program, counters)]
+
+#Splits a duration into steps of at most MAX_STEP_MINUTES, rounding up to whole minutes
+def _stepsFor(temp, durationInSeconds):
+    minutes = max(1, -(-int(durationInSeconds) // 60))
+    steps = []
+    while minutes > 0:
+        steps.append(ProgramStep(temp, min(minutes, MAX_STEP_MINUTES)))
+        minutes -= MAX_STEP_MINUTES
+    return steps
+
+'''
+Compiles the tasks of a TaskQueue (Task, Idle and Cycle entries, in order) into a CompiledProgram.
+Raises ValueError for lists the controller cannot run: idle tasks after the first step, or more cycles
+than the controller has loop counters.
+'''
+def CompileTaskList(tasklist):
+    program = CompiledProgram()
+    for task in tasklist.snapshot():
+        if task.kind is TaskKind.IDLE:
+            if program.steps:
+                raise ValueError("Idle tasks between steps cannot run from program memory")
+            program.start_delay += task.durationInSeconds
+        elif task.kind is TaskKind.TASK:
+            program.steps.extend(_stepsFor(task.temp, task.durationInSeconds))
+        else:
+            if len(program.counters) >= MAX_COUNTERS:
+                raise ValueError("The controller supports at most %i cycle tasks per program" % MAX_COUNTERS)
+            first = len(program.steps) + 1
+            program.steps.extend(_stepsFor(task.temp1, task.durationInSeconds))
+            program.steps.extend(_stepsFor(task.temp2, task.durationInSeconds))
+            if task.totalCycles > 1:
+                program.counters.append(ProgramCounter(first, len(program.steps), task.totalCycles))
+    if not program.steps:
+        raise ValueError("Task list has no steps to run")
+    return program
+
+#Step read back with PRGM DATA?,PGM:n,STEPn, e.g. "TEMP25.0,TRAMPOFF,TIME1:30"
+def ParseStep(reply):
+    temp = re.search(r'TEMP\s*(-?\d+(?:\.\d+)?)', reply)
+    time = re.search(r'TIME\s*(\d+):(\d+)', reply)
+    if not temp or not time:
+        raise ValueError(f"Unexpected program step reply: {reply}")
+    return ProgramStep(float(temp.group(1)), int(time.group(1)) * 60 + int(time.group(2)), ramp='TRAMPON' in reply)
+
+#Program summary read back with PRGM DATA?,PGM:n, e.g. "5,COUNT,A(2.3.5),END,HOLD": (step count, counters, end mode)
+def ParseProgramSummary(reply):
+    fields = [field.strip() for field in reply.split(',')]
+    if not fields[0].isdigit():
+        raise ValueError(f"Unexpected program summary reply: {reply}")
+    counters = [ProgramCounter(int(first), int(last), int(repeats))
+                for first, last, repeats in re.findall(r'[A-Z]\((\d+)\.(\d+)\.(\d+)\)', reply)]
+    end_mode = fields[fields.index('END') + 1] if 'END' in fields and fields.index('END') + 1 < len(fields) else 'HOLD'
+    return int(fields[0]), counters, end_mode
+
+#Progress of a running program from PRGM MON?: "program,step,remaining step time,counter A remaining,..."
+class ProgramStatus:
+    def __init__(self, reply):
+        fields = [field.strip() for field in reply.split(',')]
+        if len(fields) < 3:
+            raise ValueError(f"Unexpected PRGM MON? reply: {reply}")
+        self.program = int(fields[0])
+        self.step = int(fields[1])
+        hours, minutes = fields[2].split(':')
+        self.remaining_minutes = int(hours) * 60 + int(minutes)
+        self.counters = [int(field) for field in fields[3:] if field.isdigit()]
+
+    def ToDict(self):
+        return {
+            "program": self.program,
+            "step": self.step,
+            "remaining_minutes": self.remaining_minutes,
+            "counters": self.counters,
+        }
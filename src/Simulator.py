@@ -0,0 +1,455 @@
+'''Simulator.py: In-process simulator of ESPEC chamber controllers for running the software without hardware.
+A port name of the form sim://name?options opens a SimulatedSerial instead of a real port, e.g.
+    UARTMaster(port='sim://bench?addresses=1-32&latency=0.05&jitter=0.01&drop=0.01&garble=0.01&speed=60')
+Ports opened with the same name share one ChamberSimulator (one RS-485 line); the options only apply when the
+first port of that name is opened. Options:
+    addresses: Controller addresses on the line, e.g. 1-32 or 1,2,5 (default 1).
+    latency: Seconds the controller takes to start replying (default 0.05).
+    jitter: Random extra seconds added to latency, uniform in [0, jitter] (default 0).
+    drop: Probability that bytes of a reply are lost, which can cost the terminator (default 0).
+    garble: Probability that a character of a reply is corrupted (default 0).
+    speed: Simulated seconds per real second for the thermal model and programs (default 1).
+    tau: Time constant of the chamber in seconds (default 300).
+    rate: Maximum ramp rate in °C per minute (default 5).
+    seed: Seed for the fault and noise generator, for repeatable runs.
+ChamberSimulator.Unplug(seconds) emulates a USB adapter being pulled: open ports fail with OSError from then on
+and the port cannot be opened again until the time is up, like an FTDI adapter re-enumerating.
+Replies take the serial wire time of the command and reply into account (10 bits per byte at the port's baudrate).
+
+Supported commands: TYPE?, MON?, TEMP?, MODE?, TEMP,S/H/L, HUMI,S, MODE,OFF/STANDBY/CONSTANT/RUN n, POWER,ON/OFF,
+PRGM DATA WRITE (EDIT START/END, STEPn, COUNT, END), PRGM DATA?, PRGM ERASE, PRGM MON?, PRGM,ADVANCE and PRGM,END.
+'''
+
+import math
+import random
+import re
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs
+
+SCHEME = 'sim://'
+TERMINATOR = b'\r\n'
+
+AMBIENT = 25.0
+
+'''
+First-order chamber model. While the chamber runs, the temperature approaches the set point with time constant tau;
+in standby or off it drifts back to ambient with time constant ambient_tau. max_rate caps the change in °C per
+minute like the heater and refrigerator capacity of a real chamber.
+'''
+class ThermalModel:
+    def __init__(self, temperature=AMBIENT, tau=300.0, ambient_tau=1800.0, max_rate=5.0, noise=0.0, rng=None):
+        self.temperature = temperature
+        self.tau = tau
+        self.ambient_tau = ambient_tau
+        self.max_rate = max_rate
+        self.noise = noise
+        self._rng = rng if rng is not None else random.Random()
+
+    #Advances the model by seconds of simulated time towards target (None: chamber not running)
+    def advance(self, seconds, target):
+        if seconds <= 0:
+            return
+        goal = AMBIENT if target is None else target
+        tau = self.ambient_tau if target is None else self.tau
+        #Integrated in at most 1000 steps, so long gaps between reads cost the same as short ones
+        steps = max(1, min(1000, math.ceil(seconds)))
+        dt = seconds / steps
+        limit = self.max_rate / 60.0 * dt
+        for _ in range(steps):
+            change = (goal - self.temperature) * (1 - math.exp(-dt / tau))
+            self.temperature += max(-limit, min(limit, change))
+
+    def read(self):
+        if self.noise:
+            return self.temperature + self._rng.gauss(0, self.noise)
+        return self.temperature
+
+#Program memory entry: steps as (temp, minutes, ramp), counters as (first, last, repeats)
+class SimulatedProgram:
+    def __init__(self):
+        self.steps = {}
+        self.counters = []
+        self.end_mode = 'HOLD'
+
+    #Step numbers (1-based) in execution order, with the loops unrolled
+    def sequence(self):
+        numbers = list(range(1, len(self.steps) + 1))
+        for first, last, repeats in sorted(self.counters, key=lambda counter: counter[0], reverse=True):
+            if 1 <= first <= last <= len(numbers):
+                numbers = numbers[:first - 1] + numbers[first - 1:last] * repeats + numbers[last:]
+        return numbers
+
+class SimulatedChamber:
+    def __init__(self, address, speed=1.0, tau=300.0, max_rate=5.0, rng=None):
+        self.address = address
+        self.speed = speed
+        self.model = ThermalModel(tau=tau, max_rate=max_rate, rng=rng)
+        self.set_point = AMBIENT
+        self.high_limit = 150.0
+        self.low_limit = -40.0
+        self.humidity = None
+        self.mode = 'STANDBY'
+        self.programs = {}
+        self._editing = None
+        #Running program: (number, unrolled step sequence, simulated start time)
+        self._run = None
+        self._clock = 0.0
+        self._last = time.monotonic()
+
+    #Simulated seconds since the chamber was created, advancing the thermal model to now
+    def update(self):
+        now = time.monotonic()
+        elapsed = (now - self._last) * self.speed
+        self._last = now
+        target = self._programTarget() if self._run else (self.set_point if self.mode == 'CONSTANT' else None)
+        self.model.advance(elapsed, target)
+        self._clock += elapsed
+        return self._clock
+
+    #Returns the reply to one command (without address prefix), or None for commands the controller ignores
+    def handle(self, command):
+        self.update()
+        if command == 'TYPE?':
+            return 'SCP220,SH-241,%i' % self.address
+        if command == 'MODE?':
+            return self._modeName()
+        if command == 'MON?':
+            return '%.1f,%s,%s,0' % (self.model.read(), '' if self.humidity is None else '%.0f' % self.humidity, self._modeName())
+        if command == 'TEMP?':
+            return '%.1f,%.1f,%.1f,%.1f' % (self.model.read(), self._setPoint(), self.high_limit, self.low_limit)
+        match = re.fullmatch(r'TEMP,([SHL])\s*(-?\d+(?:\.\d+)?)', command)
+        if match:
+            return self._setTemp(command, match.group(1), float(match.group(2)))
+        if command.startswith('HUMI,'):
+            return 'NA:NOT AVAILABLE'
+        if command.startswith('MODE,'):
+            return self._setMode(command, command[5:].strip())
+        if command in ('POWER,ON', 'POWER,OFF'):
+            self.mode = 'STANDBY' if command == 'POWER,ON' else 'OFF'
+            self._run = None
+            return 'OK:' + command
+        if command.startswith('PRGM'):
+            return self._program(command)
+        return 'NA:COMMAND ERR'
+
+    def _modeName(self):
+        return 'RUN' if self._run else self.mode
+
+    def _setPoint(self):
+        return self._programTarget() if self._run else self.set_point
+
+    def _setTemp(self, command, which, value):
+        if which == 'S':
+            if not self.low_limit <= value <= self.high_limit:
+                return 'NA:DATA OUT OF RANGE'
+            self.set_point = value
+        elif which == 'H':
+            self.high_limit = value
+        else:
+            self.low_limit = value
+        return 'OK:' + command
+
+    def _setMode(self, command, mode):
+        match = re.fullmatch(r'RUN\s*(\d+)', mode)
+        if match:
+            program = self.programs.get(int(match.group(1)))
+            if program is None or not program.steps:
+                return 'NA:PGM NOT READY'
+            self._run = (int(match.group(1)), program.sequence(), self._clock)
+            self.mode = 'RUN'
+            return 'OK:' + command
+        if mode not in ('OFF', 'STANDBY', 'CONSTANT'):
+            return 'NA:PARAMETER ERR'
+        self.mode = mode
+        self._run = None
+        return 'OK:' + command
+
+    #(position in the unrolled sequence, seconds left in that step) of the running program, or None once it ended
+    def _programPosition(self):
+        number, sequence, started = self._run
+        program = self.programs[number]
+        elapsed = self._clock - started
+        for position, step in enumerate(sequence):
+            length = program.steps[step][1] * 60
+            if elapsed < length:
+                return position, length - elapsed
+            elapsed -= length
+        return None
+
+    def _programTarget(self):
+        number, sequence, started = self._run
+        position = self._programPosition()
+        if position is None:
+            #End step HOLD keeps the last set point in constant mode
+            last = self.programs[number].steps[sequence[-1]][0]
+            self._run = None
+            self.set_point = last
+            self.mode = 'CONSTANT'
+            return last
+        return self.programs[number].steps[sequence[position[0]]][0]
+
+    def _program(self, command):
+        fields = [field.strip() for field in command.split(',')]
+        verb = fields[0]
+        number = int(fields[1][4:]) if len(fields) > 1 and fields[1].startswith('PGM:') else None
+        #The running program cannot be edited or erased
+        if verb in ('PRGM DATA WRITE', 'PRGM ERASE') and self._run and self._run[0] == number:
+            return 'NA:PGM RUNNING'
+        if verb == 'PRGM DATA WRITE' and number is not None:
+            return self._writeProgram(command, number, fields[2:])
+        if verb == 'PRGM DATA?' and number is not None:
+            return self._readProgram(number, fields[2:])
+        if verb == 'PRGM ERASE' and number is not None:
+            self.programs.pop(number, None)
+            return 'OK:' + command
+        if verb == 'PRGM MON?':
+            return self._monitorProgram()
+        if verb == 'PRGM' and fields[1:2] == ['ADVANCE']:
+            if self._run:
+                position = self._programPosition()
+                if position is not None:
+                    #Skip the rest of the current step
+                    number, sequence, started = self._run
+                    self._run = (number, sequence, started - position[1])
+            return 'OK:' + command
+        if verb == 'PRGM' and fields[1:2] == ['END']:
+            self._run = None
+            self.mode = 'CONSTANT'
+            return 'OK:' + command
+        return 'NA:COMMAND ERR'
+
+    def _writeProgram(self, command, number, fields):
+        if fields == ['EDIT START']:
+            self._editing = number
+            self.programs.setdefault(number, SimulatedProgram())
+            return 'OK:' + command
+        if self._editing != number:
+            return 'NA:NOT IN EDIT'
+        program = self.programs[number]
+        if fields == ['EDIT END']:
+            self._editing = None
+        elif fields and fields[0].startswith('STEP'):
+            parameters = ','.join(fields[1:])
+            temp = re.search(r'TEMP\s*(-?\d+(?:\.\d+)?)', parameters)
+            duration = re.search(r'TIME\s*(\d+):(\d+)', parameters)
+            if not fields[0][4:].isdigit() or not temp or not duration:
+                return 'NA:DATA NOT READY'
+            program.steps[int(fields[0][4:])] = (float(temp.group(1)), int(duration.group(1)) * 60 + int(duration.group(2)), 'TRAMPON' in parameters)
+        elif fields and fields[0] == 'COUNT':
+            program.counters = [(int(first), int(last), int(repeats))
+                                for first, last, repeats in re.findall(r'[A-Z]\((\d+)\.(\d+)\.(\d+)\)', ','.join(fields[1:]))]
+        elif fields and fields[0] == 'END':
+            program.end_mode = fields[1] if len(fields) > 1 else 'HOLD'
+        else:
+            return 'NA:COMMAND ERR'
+        return 'OK:' + command
+
+    def _readProgram(self, number, fields):
+        program = self.programs.get(number)
+        if program is None:
+            return 'NA:PGM NOT READY'
+        if not fields:
+            counters = ''.join(',%s(%i.%i.%i)' % ('AB'[n], first, last, repeats) for n, (first, last, repeats) in enumerate(program.counters))
+            return '%i%s,END,%s' % (len(program.steps), ',COUNT' + counters if counters else '', program.end_mode)
+        step = program.steps.get(int(fields[0][4:])) if fields[0][4:].isdigit() else None
+        if step is None:
+            return 'NA:DATA NOT READY'
+        temp, minutes, ramp = step
+        return 'TEMP%.1f,%s,TIME%i:%02i' % (temp, 'TRAMPON' if ramp else 'TRAMPOFF', minutes // 60, minutes % 60)
+
+    def _monitorProgram(self):
+        if not self._run:
+            return 'NA:NOT READY'
+        position = self._programPosition()
+        if position is None:
+            self._programTarget()
+            return 'NA:NOT READY'
+        number, sequence, started = self._run
+        minutes = math.ceil(position[1] / 60)
+        counters = [repeats for first, last, repeats in self.programs[number].counters]
+        return ','.join(['%i' % number, '%i' % sequence[position[0]], '%i:%02i' % (minutes // 60, minutes % 60)] + ['%i' % n for n in counters])
+
+'''
+Controllers sharing one simulated line. Commands are routed by their address prefix; an address nobody answers to
+gets no reply, as on a real bus.
+'''
+class ChamberSimulator:
+    def __init__(self, addresses=(1,), latency=0.05, jitter=0.0, drop=0.0, garble=0.0, speed=1.0, tau=300.0,
+                 max_rate=5.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.drop = drop
+        self.garble = garble
+        self.rng = random.Random(seed)
+        self.chambers = {address: SimulatedChamber(address, speed=speed, tau=tau, max_rate=max_rate, rng=self.rng)
+                         for address in addresses}
+        self._lock = threading.Lock()
+        #Ports opened before the last unplug stay dead, as the handle of a re-enumerated adapter does
+        self.generation = 0
+        self._unplugged_until = 0.0
+
+    def Chamber(self, address):
+        return self.chambers[address]
+
+    def Unplug(self, seconds):
+        self.generation += 1
+        self._unplugged_until = time.monotonic() + seconds
+
+    def connected(self):
+        return time.monotonic() >= self._unplugged_until
+
+    #Reply bytes for one command line and the seconds until they have arrived, or None if nobody answers
+    def respond(self, line, baudrate):
+        text = line.decode('ascii', errors='replace').strip()
+        address, _, command = text.partition(',')
+        with self._lock:
+            if address.isdigit():
+                chamber = self.chambers.get(int(address))
+            else:
+                chamber = self.chambers[min(self.chambers)] if self.chambers else None
+                command = text
+            if chamber is None:
+                return None
+            reply = chamber.handle(command.strip())
+            if reply is None:
+                return None
+            data = bytearray(reply.encode('ascii') + TERMINATOR)
+            if self.garble and self.rng.random() < self.garble:
+                data[self.rng.randrange(len(data) - len(TERMINATOR))] = self.rng.randrange(33, 127)
+            if self.drop and self.rng.random() < self.drop:
+                start = self.rng.randrange(len(data))
+                del data[start:start + self.rng.randint(1, 4)]
+            delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0)
+        delay += (len(line) + len(data)) * 10.0 / baudrate
+        return bytes(data), delay
+
+'''
+Stand-in for serial.Serial with the subset of its interface UARTMaster uses. Writes are answered by the simulator;
+replies become readable once their latency and wire time have passed.
+'''
+class SimulatedSerial:
+    def __init__(self, simulator, port, baudrate=9600, timeout=1):
+        if not simulator.connected():
+            raise OSError(f"could not open port {port}: device not present")
+        self.simulator = simulator
+        self.generation = simulator.generation
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.is_open = True
+        self._received = bytearray()
+        self._pending = []  # (arrival time, bytes), in order
+        self._partial = bytearray()
+        self._condition = threading.Condition()
+
+    def write(self, data):
+        self._checkPresent()
+        self._partial.extend(data)
+        now = time.monotonic()
+        while TERMINATOR in self._partial:
+            line, _, rest = bytes(self._partial).partition(TERMINATOR)
+            self._partial = bytearray(rest)
+            answer = self.simulator.respond(line, self.baudrate)
+            if answer is not None:
+                with self._condition:
+                    #Replies leave the controller one after another
+                    start = max(now, self._pending[-1][0]) if self._pending else now
+                    self._pending.append((start + answer[1], answer[0]))
+                    self._condition.notify_all()
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        self._checkPresent()
+        with self._condition:
+            self._collect(time.monotonic())
+            return len(self._received)
+
+    def read_until(self, expected=b'\n', size=None):
+        self._checkPresent()
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._collect(now)
+                end = self._received.find(expected) if expected else -1
+                if end >= 0:
+                    return self._take(end + len(expected))
+                if size is not None and len(self._received) >= size:
+                    return self._take(size)
+                waits = [arrival - now for arrival, data in self._pending[:1]]
+                if deadline is not None:
+                    if now >= deadline:
+                        return self._take(len(self._received))
+                    waits.append(deadline - now)
+                self._condition.wait(min(waits) if waits else None)
+
+    def readline(self, size=None):
+        return self.read_until(b'\n', size)
+
+    def read(self, size=1):
+        return self.read_until(None, size) if size else b''
+
+    def reset_input_buffer(self):
+        self._checkPresent()
+        with self._condition:
+            self._collect(time.monotonic())
+            self._received.clear()
+
+    def reset_output_buffer(self):
+        self._partial.clear()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+    def _checkPresent(self):
+        if self.generation != self.simulator.generation:
+            raise OSError(f"{self.port}: device disconnected")
+
+    def _collect(self, now):
+        while self._pending and self._pending[0][0] <= now:
+            self._received.extend(self._pending.pop(0)[1])
+
+    def _take(self, count):
+        data = bytes(self._received[:count])
+        del self._received[:count]
+        return data
+
+_simulators = {}
+_simulators_lock = threading.Lock()
+
+#Parses "1-4,7" into [1, 2, 3, 4, 7]
+def _parseAddresses(text):
+    addresses = []
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        addresses.extend(range(int(first), int(last or first) + 1))
+    return addresses
+
+#Returns the ChamberSimulator for a sim:// port name, creating it from the port's options the first time
+def get_simulator(url):
+    parts = urlsplit(url)
+    with _simulators_lock:
+        if parts.netloc not in _simulators:
+            options = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+            _simulators[parts.netloc] = ChamberSimulator(
+                addresses=_parseAddresses(options.get('addresses', '1')),
+                latency=float(options.get('latency', 0.05)),
+                jitter=float(options.get('jitter', 0)),
+                drop=float(options.get('drop', 0)),
+                garble=float(options.get('garble', 0)),
+                speed=float(options.get('speed', 1)),
+                tau=float(options.get('tau', 300)),
+                max_rate=float(options.get('rate', 5)),
+                seed=int(options['seed']) if 'seed' in options else None)
+        return _simulators[parts.netloc]
+
+def is_simulated(port):
+    return isinstance(port, str) and port.startswith(SCHEME)
+
+def serial_for_url(url, baudrate=9600, timeout=1):
+    return SimulatedSerial(get_simulator(url), url, baudrate, timeout)
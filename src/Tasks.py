@@ -1,13 +1,17 @@
 '''Tasks.py: Defines the Task and LinkedList classes for managing oven tasks. List implements a queue using a linked list structure.
+TaskQueue is the queue used by the oven: a doubly-linked list with a db_id index and a lock, so append, pop, delete
+and reorder are O(1) and safe to call from the Flask and timer threads.
 '''
 
 from Timer import ProgTimer
 import threading
+from enum import Enum
 #A single node in a linked list
 class Node:
     def __init__(self, data):
         self.data = data
         self.next = None
+        self.prev = None
         self.active = False
         self.finished = False
         return
@@ -43,29 +47,193 @@ class LinkedList:
         i = 1
         print("Task List:")
         while current:
-            if current.data.taskName == "Task":
-                print("Task "+ str(i) + ": " + "temp: " + str(current.data.temp) + "°C, " + "duration: " + current.data.hours + "hr " + current.data.minutes + "min " + current.data.seconds + "s")
-            elif current.data.taskName == "Idle":
-                print("Task "+ str(i) + ": " + "Idle for: " + current.data.hours + "hr " + current.data.minutes + "min " + current.data.seconds + "s")
+            task = current.data
+            if task.kind is TaskKind.TASK:
+                print(f"Task {i}: temp: {task.temp}°C, duration: {task.hours}hr {task.minutes}min {task.seconds}s")
+            elif task.kind is TaskKind.IDLE:
+                print(f"Task {i}: Idle for: {task.hours}hr {task.minutes}min {task.seconds}s")
             else:
-                print("Task "+ str(i) + ": " + "Cycle from: " + str(current.data.temp1) + "°C, " + "to " + str(current.data.temp2) + "°C for duration: " + current.data.hours + "hr " + current.data.minutes + "min " + current.data.seconds + "s for " + str(current.data.totalCycles) + " cycles")
+                print(f"Task {i}: Cycle from: {task.temp1}°C, to {task.temp2}°C for duration: {task.hours}hr {task.minutes}min {task.seconds}s for {task.totalCycles} cycles")
             i += 1
             current = current.next
         return
 
+'''
+Queue of tasks with O(1) enqueue, pop_head, delete by db_id and move, indexed by the tasks' db_id.
+Nodes keep the LinkedList interface (head, node.data, node.next) so existing traversals keep working.
+All mutations hold an internal lock; iterate with snapshot() when other threads may change the queue.
+'''
+class TaskQueue(LinkedList):
+    def __init__(self):
+        super().__init__()
+        self.tail = None
+        self._index = {}
+        self._length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def __contains__(self, db_id):
+        return db_id in self._index
+
+    def enqueue(self, data):
+        return self._insert(data, at_head=False)
+
+    #Queues a task in front of all others, e.g. a task that is resumed after a restart
+    def push_head(self, data):
+        return self._insert(data, at_head=True)
+
+    '''
+    Takes the head node in one step under the lock and returns it, or None if the queue is empty. The node is removed
+    from the queue unless keep(task) is true; a kept node can be removed later with remove(node).
+    '''
+    def pop_head(self, keep=None):
+        with self._lock:
+            node = self.head
+            if node is not None and (keep is None or not keep(node.data)):
+                self._remove(node)
+            return node
+
+    #Removes node if it is still queued; returns False if it was already removed
+    def remove(self, node):
+        with self._lock:
+            if node is not self.head and node.prev is None:
+                return False
+            self._remove(node)
+            return True
+
+    #Removes the task with this db_id; returns False if it is not queued
+    def delete(self, db_id):
+        with self._lock:
+            node = self._index.get(db_id)
+            if node is None:
+                return False
+            self._remove(node)
+            return True
+
+    #Moves the task with db_id in front of the task with before_db_id, or to the end if before_db_id is None
+    def move(self, db_id, before_db_id=None):
+        with self._lock:
+            node = self._index.get(db_id)
+            before = self._index.get(before_db_id) if before_db_id is not None else None
+            if node is None or node is before or (before_db_id is not None and before is None):
+                return False
+            self._unlink(node)
+            self._link(node, before)
+            return True
+
+    def get(self, db_id):
+        node = self._index.get(db_id)
+        return node.data if node is not None else None
+
+    def clear(self):
+        with self._lock:
+            self.head = None
+            self.tail = None
+            self._index.clear()
+            self._length = 0
+
+    #List of the queued tasks in order, taken under the lock
+    def snapshot(self):
+        with self._lock:
+            tasks = []
+            current = self.head
+            while current:
+                tasks.append(current.data)
+                current = current.next
+            return tasks
+
+    def print_list(self):
+        with self._lock:
+            super().print_list()
+
+    def _insert(self, data, at_head):
+        new_node = Node(data)
+        with self._lock:
+            self._link(new_node, self.head if at_head else None)
+            db_id = getattr(data, 'db_id', None)
+            if db_id not in (None, "None"):
+                self._index[db_id] = new_node
+        return new_node
+
+    #Inserts node before the node before, or at the tail if before is None
+    def _link(self, node, before):
+        if before is None:
+            node.prev = self.tail
+            node.next = None
+            if self.tail:
+                self.tail.next = node
+            else:
+                self.head = node
+            self.tail = node
+        else:
+            node.prev = before.prev
+            node.next = before
+            if before.prev:
+                before.prev.next = node
+            else:
+                self.head = node
+            before.prev = node
+        self._length += 1
+
+    def _unlink(self, node):
+        if node.prev:
+            node.prev.next = node.next
+        else:
+            self.head = node.next
+        if node.next:
+            node.next.prev = node.prev
+        else:
+            self.tail = node.prev
+        node.prev = None
+        node.next = None
+        self._length -= 1
+
+    def _remove(self, node):
+        self._unlink(node)
+        db_id = getattr(node.data, 'db_id', None)
+        if self._index.get(db_id) is node:
+            del self._index[db_id]
+
 
     
     
 
 
+#Kind of a queued task; the value is the name used by the web interface and database
+class TaskKind(Enum):
+    TASK = "Task"
+    IDLE = "Idle"
+    CYCLE = "Cycle"
+
     #Defines the structure of a Task
 class Task:
+    #Slots keep each record small when thousands of steps are queued
+    __slots__ = ('kind', 'temp', 'durationInSeconds', 'db_id')
+
     def __init__(self, temp, hours, minutes, seconds, taskName="Task", db_id=None):
-        self.temp = temp
-        self.hours = str(hours)
-        self.minutes = str(minutes)
-        self.seconds = str(seconds)
-        self.durationInSeconds = (hours * 3600 + minutes * 60 + seconds)
-        self.taskName = taskName
+        self.kind = TaskKind(taskName)
+        self.temp = float(temp)
+        self.durationInSeconds = int(hours * 3600 + minutes * 60 + seconds)
         self.db_id = db_id
         return
+
+    @property
+    def taskName(self):
+        return self.kind.value
+
+    @property
+    def hours(self):
+        return self.durationInSeconds // 3600
+
+    @property
+    def minutes(self):
+        return (self.durationInSeconds % 3600) // 60
+
+    @property
+    def seconds(self):
+        return self.durationInSeconds % 60
@@ -0,0 +1,251 @@
+'''Telemetry.py: Records chamber temperature samples for ramp/soak data collection.
+Samples are kept in a fixed-size, array-backed ring buffer in memory and appended in batches to a per-run binary
+file of fixed-width records, so weeks of 1 Hz data cost a constant amount of memory and 24 bytes per sample on disk.
+
+File layout: 16 byte header (magic, format version, record size) followed by records of
+    timestamp (float64, unix seconds), PV (float32), SV (float32), state (uint8, index into STATES),
+    task id (int32, -1 if none), cycle (uint16), half cycle (uint8)
+all little-endian. The record area can be memory-mapped and unpacked with RECORD.iter_unpack.
+'''
+
+import bisect
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from datetime import datetime
+
+MAGIC = b'ESPT'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHH8x')
+RECORD = struct.Struct('<dffBiHB')
+
+#Chamber states as stored in the state field
+STATES = ["IDLE", "HEATING", "COOLING", "SOAKING", "CYCLE", "PROGRAM"]
+
+class TelemetryRecorder:
+    '''
+    directory: Folder the run file is created in.
+    name: Label included in the file name (e.g. chamber address).
+    capacity: Number of most recent samples kept in memory.
+    flush_every: Samples buffered before they are written to disk.
+    flush_interval: Maximum seconds a sample waits in memory before being written.
+    '''
+    def __init__(self, directory, name="chamber", capacity=86400, flush_every=60, flush_interval=60.0):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{datetime.now():%Y%m%d_%H%M%S}_{name}.bin")
+        self.capacity = capacity
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        #One preallocated array per field; _head is the next slot to write
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.pv = array('f', bytes(4 * capacity))
+        self.sv = array('f', bytes(4 * capacity))
+        self.states = array('B', bytes(capacity))
+        self.task_ids = array('i', bytes(4 * capacity))
+        self.cycles = array('H', bytes(2 * capacity))
+        self.half_cycles = array('B', bytes(capacity))
+        self._head = 0
+        self.count = 0
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        #Rollups for plotting, updated with every sample
+        self.history = RollupHistory()
+        self._file = open(self.path, 'wb')
+        self._file.write(HEADER.pack(MAGIC, FORMAT_VERSION, RECORD.size))
+        self._file.flush()
+
+    #Adds one sample; writes the pending batch to disk when it is full or old enough
+    def record(self, pv, sv, state="IDLE", task_id=None, cycle=0, half_cycle=0, timestamp=None):
+        with self._lock:
+            i = self._head
+            self.timestamps[i] = time.time() if timestamp is None else timestamp
+            self.pv[i] = pv
+            self.sv[i] = sv
+            self.states[i] = STATES.index(state) if state in STATES else 0
+            self.task_ids[i] = -1 if task_id is None else int(task_id)
+            self.cycles[i] = cycle
+            self.half_cycles[i] = half_cycle
+            self.history.add(self.timestamps[i], pv, sv)
+            self._head = (i + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+            self._unflushed = min(self._unflushed + 1, self.capacity)
+            if self._unflushed >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    #Returns the in-memory samples from oldest to newest as (timestamp, pv, sv, state, task_id, cycle, half_cycle)
+    def samples(self):
+        with self._lock:
+            start = (self._head - self.count) % self.capacity
+            return [self._sample(index % self.capacity) for index in range(start, start + self.count)]
+
+    def latest(self):
+        with self._lock:
+            if self.count == 0:
+                return None
+            return self._sample((self._head - 1) % self.capacity)
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._file.close()
+
+    def _sample(self, i):
+        return (self.timestamps[i], self.pv[i], self.sv[i], STATES[self.states[i]],
+                self.task_ids[i], self.cycles[i], self.half_cycles[i])
+
+    #Packs the samples not yet on disk into one buffer and writes it in a single call
+    def _flush(self):
+        if self._unflushed and not self._file.closed:
+            batch = bytearray(RECORD.size * self._unflushed)
+            start = (self._head - self._unflushed) % self.capacity
+            for n in range(self._unflushed):
+                i = (start + n) % self.capacity
+                RECORD.pack_into(batch, n * RECORD.size, self.timestamps[i], self.pv[i], self.sv[i], self.states[i],
+                                 self.task_ids[i], self.cycles[i], self.half_cycles[i])
+            self._file.write(batch)
+            self._file.flush()
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+
+#Fixed-size ring of time buckets holding min/max/mean PV and mean SV for one bucket width
+class RollupLevel:
+    def __init__(self, seconds, capacity):
+        self.seconds = seconds
+        self.capacity = capacity
+        self.starts = array('d', bytes(8 * capacity))
+        self.mins = array('f', bytes(4 * capacity))
+        self.maxs = array('f', bytes(4 * capacity))
+        self.pv_sums = array('d', bytes(8 * capacity))
+        self.sv_sums = array('d', bytes(8 * capacity))
+        self.counts = array('I', bytes(4 * capacity))
+        self._head = 0
+        self.count = 0
+
+    def add(self, timestamp, pv, sv):
+        start = math.floor(timestamp / self.seconds) * self.seconds
+        last = (self._head - 1) % self.capacity
+        if self.count and self.starts[last] == start:
+            i = last
+            self.mins[i] = min(self.mins[i], pv)
+            self.maxs[i] = max(self.maxs[i], pv)
+            self.pv_sums[i] += pv
+            self.sv_sums[i] += sv
+            self.counts[i] += 1
+            return
+        if self.count and start < self.starts[last]:
+            return  # Samples arriving out of order are dropped rather than reshuffling the ring
+        i = self._head
+        self.starts[i] = start
+        self.mins[i] = pv
+        self.maxs[i] = pv
+        self.pv_sums[i] = pv
+        self.sv_sums[i] = sv
+        self.counts[i] = 1
+        self._head = (i + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    #Ring slot of the n-th oldest bucket
+    def slot(self, n):
+        return (self._head - self.count + n) % self.capacity
+
+    def oldest(self):
+        return self.starts[self.slot(0)] if self.count else None
+
+    #Range of logical positions [first, last) of buckets overlapping [start, end), including the one straddling start
+    def span(self, start, end):
+        positions = range(self.count)
+        key = lambda n: self.starts[self.slot(n)]
+        first = bisect.bisect_right(positions, start, key=key) - 1
+        if first < 0 or key(first) + self.seconds <= start:
+            first += 1
+        return first, bisect.bisect_left(positions, end, key=key)
+
+'''
+Multi-resolution rollups of a temperature run. Every sample updates one bucket per level, so the cost of keeping
+them current is constant, and a query reads at most a few buckets per requested point whatever the run length.
+levels: (bucket seconds, number of buckets kept) from finest to coarsest.
+'''
+class RollupHistory:
+    def __init__(self, levels=((1, 8192), (10, 8192), (60, 8192), (600, 8192), (3600, 8192))):
+        self.levels = [RollupLevel(seconds, capacity) for seconds, capacity in levels]
+        self.first_timestamp = None
+        self._lock = threading.Lock()
+
+    def add(self, timestamp, pv, sv):
+        with self._lock:
+            if self.first_timestamp is None:
+                self.first_timestamp = timestamp
+            for level in self.levels:
+                level.add(timestamp, pv, sv)
+
+    '''
+    Returns (bucket seconds used, points) for the window [start, end) decimated to at most width points.
+    Each point is [time, min PV, max PV, mean PV, mean SV] for one slice of (end - start) / width seconds.
+    '''
+    def query(self, start, end, width):
+        if end <= start or width <= 0:
+            return 0, []
+        step = (end - start) / width
+        with self._lock:
+            level = self._pickLevel(start, step)
+            first, last = level.span(start, end)
+            points = []
+            for n in range(first, last):
+                i = level.slot(n)
+                t = max(level.starts[i], start)
+                index = min(int((t - start) / step), width - 1)
+                if points and points[-1][0] == index:
+                    point = points[-1]
+                    point[1] = min(point[1], level.mins[i])
+                    point[2] = max(point[2], level.maxs[i])
+                    point[3] += level.pv_sums[i]
+                    point[4] += level.sv_sums[i]
+                    point[5] += level.counts[i]
+                else:
+                    points.append([index, level.mins[i], level.maxs[i], level.pv_sums[i], level.sv_sums[i], level.counts[i]])
+        return level.seconds, [[start + index * step, low, high, pv_sum / count, sv_sum / count]
+                               for index, low, high, pv_sum, sv_sum, count in points]
+
+    '''
+    Coarsest level that still resolves step, moving to coarser levels if it no longer reaches back to start.
+    A window starting before the first sample only needs to reach back to that sample, not to start.
+    '''
+    def _pickLevel(self, start, step):
+        if self.first_timestamp is not None:
+            start = max(start, self.first_timestamp)
+        candidates = [n for n, level in enumerate(self.levels) if level.seconds <= step]
+        n = candidates[-1] if candidates else 0
+        while n < len(self.levels) - 1 and (self.levels[n].oldest() is None or self.levels[n].oldest() > start):
+            n += 1
+        return self.levels[n]
+
+'''
+Reads a run file back, yielding (timestamp, pv, sv, state, task_id, cycle, half_cycle) tuples.
+The file is memory-mapped, so long runs are not loaded into memory at once.
+'''
+def read_run(path):
+    with open(path, 'rb') as f:
+        magic, version, record_size = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or record_size != RECORD.size:
+            raise ValueError(f"{path} is not a telemetry file of format version {FORMAT_VERSION}")
+        length = os.fstat(f.fileno()).st_size
+        usable = (length - HEADER.size) // RECORD.size * RECORD.size
+        if usable == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)[HEADER.size:HEADER.size + usable]
+            try:
+                for timestamp, pv, sv, state, task_id, cycle, half_cycle in RECORD.iter_unpack(view):
+                    yield (timestamp, pv, sv, STATES[state] if state < len(STATES) else "IDLE",
+                           task_id, cycle, half_cycle)
+            finally:
+                view.release()
@@ -1,10 +1,98 @@
 '''
 Timer.py: Implements a Timer class for managing countdown timers in HH:MM format for ESPEC ovens and an internal Python timer in HH:MM:SS format.
+Also provides the Scheduler that runs every timed callback of the program from a single thread.
 '''
 
 
 import time
 import threading
+import heapq
+import itertools
+
+#Handle to a callback queued on a Scheduler
+class ScheduledCall:
+    def __init__(self, deadline, fn, args, executor=None):
+        self.deadline = deadline
+        self.fn = fn
+        self.args = args
+        self.executor = executor
+        self.cancelled = False
+
+    #Prevents the callback from running if it has not started yet
+    def cancel(self):
+        self.cancelled = True
+
+    #Runs the callback unless it was cancelled while waiting for its executor
+    def run(self):
+        if self.cancelled:
+            return
+        try:
+            self.fn(*self.args)
+        except Exception as e:
+            print(f"Error in scheduled callback {getattr(self.fn, '__name__', self.fn)}: {e}")
+
+'''
+Heap-based scheduler that owns all deadlines in the program.
+Callbacks run one after another on a single daemon thread, so thousands of waits cost one thread instead of one
+threading.Timer each. Callbacks should return quickly; long work delays every other deadline. Callbacks that do
+serial I/O are given an executor (e.g. the chamber's engine worker, see SH241): the scheduler thread only hands them
+over when they are due, so a chamber that does not answer cannot delay another chamber's deadlines.
+'''
+class Scheduler:
+    def __init__(self):
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    #Runs fn(*args) after delay seconds (on executor if given) and returns a ScheduledCall that can be cancelled
+    def schedule(self, delay, fn, *args, executor=None):
+        call = ScheduledCall(time.monotonic() + delay, fn, args, executor)
+        with self._condition:
+            heapq.heappush(self._heap, (call.deadline, next(self._sequence), call))
+            # Wake the thread in case the new deadline is earlier than the one it is waiting for
+            self._condition.notify()
+        return call
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    deadline, seq, call = self._heap[0]
+                    if call.cancelled:
+                        heapq.heappop(self._heap)
+                        continue
+                    remaining = deadline - time.monotonic()
+                    if remaining > 0:
+                        self._condition.wait(remaining)
+                        continue
+                    heapq.heappop(self._heap)
+                    break
+            if call.cancelled:
+                continue
+            if call.executor is None:
+                call.run()
+                continue
+            try:
+                call.executor.submit(call.run)
+            except RuntimeError as e:
+                #The executor was shut down, e.g. the chamber was closed
+                print(f"Dropped scheduled callback {getattr(call.fn, '__name__', call.fn)}: {e}")
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+#Returns the scheduler shared by the whole program, starting it on first use
+def getScheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
 
 #Class used for controlling a countdown timer for ESPEC ovens
 class ProgTimer:
@@ -52,8 +140,7 @@ class ProgTimer:
             self.timer.cancel()
         # Clear the stop event before starting the timer
         self.stop_event.clear() 
-        self.timer = threading.Timer(self.minutes * 60, self.timerFinished)
-        self.timer.start()
+        self.timer = getScheduler().schedule(self.minutes * 60, self.timerFinished)
         return
     
 #Class used for controlling a simple countdown timer in HH:MM:SS format in python
@@ -100,7 +187,7 @@ class PyTimer():
             self.stop_event.set()
             return
         # Schedule the next tick after 1 second
-        threading.Timer(1, self.timerTick).start()
+        getScheduler().schedule(1, self.timerTick)
         return
     
     def runTimer(self):
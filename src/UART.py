@@ -4,6 +4,13 @@ import serial.tools.list_ports
 import time
 import sys
 import glob
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
+
+import Simulator
+from Metrics import MetricSet
 
 '''
 UART Master class for serial communication
@@ -12,16 +19,79 @@ Data bits: 8
 Parity: None
 Stop bits: 1
 '''
+
+#Every reply from the controller ends with CR LF
+TERMINATOR = b'\r\n'
+
+#Remembers the last port each controller answered on, so the next start validates it before scanning
+PORT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'port_cache.json')
+
+#Port -> UARTMaster that holds it, so autodetection never gives one adapter to two chambers
+_claimed_ports = {}
+_claims_lock = threading.Lock()
+
+#Commands that must not be sent twice if their reply is lost (PRGM,ADVANCE would skip another step)
+NOT_RETRIED = ("PRGM",)
+
+#Verbs of pre-encoded commands, which are few and sent over and over
+_encoded_verbs = {}
+
+#Verb a command is counted under in the metrics: "1,TEMP,S25.0" -> "TEMP", "1,PRGM MON?" -> "PRGM MON?"
+def command_verb(cmd):
+    if isinstance(cmd, bytes):
+        verb = _encoded_verbs.get(cmd)
+        if verb is None:
+            verb = command_verb(cmd.decode('ascii', errors='replace').strip())
+            if len(_encoded_verbs) < 1024:
+                _encoded_verbs[cmd] = verb
+        return verb
+    fields = cmd.split(',')
+    if len(fields) > 1 and fields[0].strip().isdigit():
+        return fields[1].strip()
+    return fields[0].strip()
+
 class UARTMaster:
-    def __init__(self, port='COM3', baudrate=9600, timeout=1, use_rs485=False, device_address=1):
+    '''
+    autodetect: Scan the serial ports for the controller on construction. Pass False to use port as given.
+    port: Serial port name, or a sim:// port to talk to simulated controllers instead (see Simulator.py).
+    retries: Times a command is sent again after a timeout or an invalid reply, waiting backoff seconds before
+             the first retry and twice as long before each next one.
+    reopen_interval: Minimum seconds between attempts to reopen the port after it disappeared (USB unplugged or
+                     re-enumerated).
+    cache_key: Name the detected port is cached and claimed under (default: the device address). Chambers at the
+               same address on different adapters need different keys.
+    '''
+    def __init__(self, port='COM3', baudrate=9600, timeout=1, use_rs485=False, device_address=1, autodetect=True,
+                 retries=2, backoff=0.05, reopen_interval=2.0, cache_key=None):
         self.port = port
         self.baudrate = baudrate
         self.timeout = timeout
         self.ser = None
         self.use_rs485 = use_rs485
         self.address = device_address  # Store the target device address
+        self.cache_key = str(device_address) if cache_key is None else str(cache_key)
         self.oven_connected = False
-        self.autodetect_oven_port()  # Attempt to auto-detect the oven port on initialization
+        self.retries = retries
+        self.backoff = backoff
+        self.reopen_interval = reopen_interval
+        #Set while the port should be open, so Transact reopens it after a disconnect but not after Close()
+        self._keep_open = False
+        self._last_reopen = 0.0
+        #Round-trip time, bytes and failures of every Transact, per command verb
+        self.metrics = MetricSet("espec_command_duration_seconds", "verb", "Round-trip time of serial commands.", {
+            "timeouts": "Commands that got no complete reply in time.",
+            "retries": "Commands sent again after a failed attempt.",
+            "bytes_sent": "Bytes written to the port.",
+            "bytes_received": "Bytes of complete replies read from the port.",
+            "invalid_replies": "Replies that arrived but failed validation (garbled or out of sync).",
+            "resyncs": "Times stale input was drained after a failed attempt.",
+            "disconnects": "Serial errors that closed the port.",
+            "reopens": "Times the port was reopened after a disconnect.",
+        })
+        if autodetect and not Simulator.is_simulated(port):
+            self.autodetect_oven_port()  # Attempt to auto-detect the oven port on initialization
+        elif not Simulator.is_simulated(port):
+            self.claim_port(port)  # A configured port is never offered to a chamber that autodetects
 
     def CreateDeviceInfoList(self):
         pass
@@ -32,6 +102,11 @@ class UARTMaster:
     #Opens the serial port
     def Open(self):
         try:
+            if Simulator.is_simulated(self.port):
+                self.ser = Simulator.serial_for_url(self.port, self.baudrate, self.timeout)
+                self.oven_connected = True
+                self._keep_open = True
+                return
             self.ser = serial.Serial(
                 port=self.port,
                 baudrate=self.baudrate,
@@ -52,24 +127,66 @@ class UARTMaster:
                 )
                 self.ser.rs485_mode = rs485_conf
             self.oven_connected = True
-        except serial.SerialException as e:
+            self._keep_open = True
+        except (serial.SerialException, OSError) as e:
             print(f"Error opening serial port: {e}")
             self.ser = None
             self.oven_connected = False
 
     def Close(self):
+        self._keep_open = False
         if self.ser:
             self.ser.close()
 
+    '''
+    Reopens the port after it disappeared. An FTDI adapter that re-enumerates can come back under another name,
+    so if the old name does not open, the ports are scanned again. Attempts are at least reopen_interval apart.
+    '''
+    def Reopen(self):
+        if time.monotonic() - self._last_reopen < self.reopen_interval:
+            return False
+        self._last_reopen = time.monotonic()
+        print(f"Reopening serial port {self.port}...")
+        self.Open()
+        if not self.oven_connected and not Simulator.is_simulated(self.port) and self.autodetect_oven_port():
+            self.Open()
+        self._keep_open = True
+        return self.oven_connected
+
+    #Closes the port after a serial error, keeping it marked for Reopen
+    def _disconnected(self, error):
+        print(f"Serial error on {self.port}: {error}")
+        try:
+            self.ser.close()
+        except (serial.SerialException, OSError):
+            pass
+        self.ser = None
+        self.oven_connected = False
+
+    #Waits until the line is quiet and drops whatever arrived, so a late or garbled reply cannot be taken for the next one
+    def Resync(self, quiet_time=None):
+        if quiet_time is None:
+            #Five character times, at least 10ms
+            quiet_time = max(0.01, 50.0 / self.baudrate)
+        for _ in range(10):
+            time.sleep(quiet_time)
+            if not self.ser.in_waiting:
+                break
+            self.ser.reset_input_buffer()
+
     def Purge(self):
         if self.ser:
             self.ser.reset_input_buffer()
             self.ser.reset_output_buffer()
 
+    #cmd is a str, or pre-encoded bytes that already end with the terminator (see Commands.py)
     def Write(self, cmd):
         if self.ser and self.ser.is_open:
-            full_command = f"{cmd}\r\n"
-            self.ser.write(full_command.encode('ascii'))
+            if isinstance(cmd, bytes):
+                self.ser.write(cmd)
+            else:
+                full_command = f"{cmd}\r\n"
+                self.ser.write(full_command.encode('ascii'))
         else:
             print("Error: Port not open")
 
@@ -78,47 +195,176 @@ class UARTMaster:
             # Read until newline
             return self.ser.readline().decode('ascii').strip()
         return None
+
+    '''
+    Sends a command and waits for the controller's reply.
+    Returns the reply as soon as the terminator arrives (e.g. "25.0,30.0,100.0,-40.0" or "OK:TEMP,S30.0"),
+    or None if no valid reply came back within timeout seconds (defaults to the port timeout) in any attempt.
+    A command given as pre-encoded bytes gets its reply as bytes, without the terminator and not decoded.
+    validate: Optional check of the reply (e.g. Commands.MON_REPLY.fullmatch); a reply failing it counts as garbled.
+    After a timeout, an invalid reply or a serial error the line is resynchronized and the command is sent again,
+    up to retries times (never for NOT_RETRIED verbs). A port that disappeared is reopened first.
+    '''
+    def Transact(self, cmd, timeout=None, validate=None, retries=None):
+        if timeout is None:
+            timeout = self.timeout
+        verb = command_verb(cmd)
+        if retries is None:
+            retries = 0 if verb in NOT_RETRIED else self.retries
+        for attempt in range(retries + 1):
+            if attempt:
+                self.metrics.increment(verb, "retries")
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            if not (self.ser and self.ser.is_open):
+                if not self._keep_open:
+                    print("Error: Port not open")
+                    return None
+                if not self.Reopen():
+                    continue
+                self.metrics.increment(verb, "reopens")
+            try:
+                reply = self._attempt(cmd, timeout, verb)
+            except (serial.SerialException, OSError) as e:
+                self.metrics.increment(verb, "disconnects")
+                self._disconnected(e)
+                continue
+            if reply is not None and (validate is None or validate(reply)):
+                return reply
+            if reply is not None:
+                self.metrics.increment(verb, "invalid_replies")
+            self.metrics.increment(verb, "resyncs")
+            try:
+                self.Resync()
+            except (serial.SerialException, OSError) as e:
+                self.metrics.increment(verb, "disconnects")
+                self._disconnected(e)
+        return None
+
+    #One write and read of cmd, recorded in the metrics
+    def _attempt(self, cmd, timeout, verb):
+        encoded = isinstance(cmd, bytes)
+        started = time.perf_counter()
+        #Throw away stale bytes so the reply read belongs to this command
+        self.ser.reset_input_buffer()
+        self.Write(cmd)
+        reply = self.ReadReply(timeout, raw=encoded)
+        self.metrics.observe(verb, time.perf_counter() - started)
+        self.metrics.increment(verb, "bytes_sent", len(cmd) if encoded else len(cmd) + len(TERMINATOR))
+        if reply is None:
+            self.metrics.increment(verb, "timeouts")
+        else:
+            self.metrics.increment(verb, "bytes_received", len(reply) + len(TERMINATOR))
+        return reply
+
+    '''
+    Reads a single terminated reply, giving up after timeout seconds. raw returns the bytes before the terminator.
+    The port keeps the last timeout used: setting it reconfigures an open port (tcsetattr, SetCommTimeouts), so it is
+    only set when a command needs a different one, not twice per transaction.
+    '''
+    def ReadReply(self, timeout, raw=False):
+        if self.ser.timeout != timeout:
+            self.ser.timeout = timeout
+        data = self.ser.read_until(TERMINATOR)
+        if not data.endswith(TERMINATOR):
+            return None
+        if raw:
+            return data[:-len(TERMINATOR)]
+        return data.decode('ascii', errors='replace').strip()
     
-    def autodetect_oven_port(self):
+    '''
+    Finds the port the controller is connected to and stores it in self.port.
+    The port cached from the last successful run is validated first; otherwise every port is pinged concurrently
+    and the scan stops at the first valid reply to TYPE?, so startup time does not grow with the number of adapters.
+    '''
+    def autodetect_oven_port(self, probe_timeout=0.5):
         print("Scanning for oven controller...")
-        
-        # 1. Get a list of ALL hardware ports plugged into the laptop
-        available_ports = serial.tools.list_ports.comports()
-        
+
+        # 1. Try the port that answered last time, unless another chamber holds it now
+        cached_port = self.load_cached_port()
+        if cached_port and not self.port_claimed(cached_port) and self.probe_port(cached_port, probe_timeout) \
+                and self.claim_port(cached_port):
+            print(f"SUCCESS: Oven detected on {cached_port}!")
+            self.port = cached_port
+            return self.port
+
+        # 2. Get a list of ALL hardware ports plugged into the laptop that no other chamber holds
+        available_ports = [p.device for p in serial.tools.list_ports.comports()
+                           if p.device != cached_port and not self.port_claimed(p.device)]
+
         if not available_ports:
             print("No serial cables detected. Plug in the USB adapter!")
             return None
 
-        # 2. Test them one by one
-        for port_info in available_ports:
-            test_port = port_info.device # e.g., 'COM3', 'COM4'
-            print(f"Pinging {test_port}...")
-            
-            try:
-                # Open the port temporarily with a very short timeout
-                temp_connection = serial.Serial(test_port, baudrate=9600, timeout=1)
-                
-                # Send a harmless Espec command (like asking for the monitor status)
-                temp_connection.write(('%i,TYPE?\r\n' % self.address).encode('ascii'))
-                
-                # Wait a split second, then read the response
-                time.sleep(0.5) 
-                response = temp_connection.readline().decode('ascii').strip()
-                
-                # Always close the temporary connection!
-                temp_connection.close()
-                
-                # 3. If we get text back, we found the winner!
-                if response:
+        # 3. Ping them all at once and take the first one that answers
+        pool = ThreadPoolExecutor(max_workers=len(available_ports))
+        probes = {pool.submit(self.probe_port, port, probe_timeout): port for port in available_ports}
+        try:
+            for probe in as_completed(probes, timeout=probe_timeout + 1):
+                if probe.result() and self.claim_port(probes[probe]):
+                    test_port = probes[probe]
                     print(f"SUCCESS: Oven detected on {test_port}!")
                     self.port = test_port  # Set the detected port for future use
-                    return
+                    self.save_cached_port()
+                    return self.port
+        except TimeoutError:
+            pass
+        finally:
+            # Don't wait for ports that are still hanging; their probes close themselves
+            pool.shutdown(wait=False, cancel_futures=True)
 
-            except serial.SerialException:
-                # If the port is locked by another program (Access Denied), 
-                # or isn't actually RS-232, Python silently skips it and tries the next one.
-                pass
-                
         print("Scan complete. Oven did not respond on any port.")
         return None
-        
+
+    #Returns True if a controller at this address answers TYPE? on the port
+    def probe_port(self, test_port, probe_timeout=0.5):
+        print(f"Pinging {test_port}...")
+        try:
+            # Open the port temporarily with a very short timeout
+            temp_connection = serial.Serial(test_port, baudrate=self.baudrate, timeout=probe_timeout)
+            try:
+                # Send a harmless Espec command and return as soon as the reply is in
+                temp_connection.write(('%i,TYPE?\r\n' % self.address).encode('ascii'))
+                response = temp_connection.read_until(TERMINATOR)
+            finally:
+                # Always close the temporary connection!
+                temp_connection.close()
+            return response.endswith(TERMINATOR) and len(response.strip()) > 0
+        except (serial.SerialException, OSError):
+            # If the port is locked by another program (Access Denied),
+            # or isn't actually RS-232, it is skipped.
+            return False
+
+    #True if another connection in this process holds port
+    def port_claimed(self, port):
+        with _claims_lock:
+            return _claimed_ports.get(port, self) is not self
+
+    #Takes port for this connection, releasing the one it held before; False if another connection holds it
+    def claim_port(self, port):
+        with _claims_lock:
+            if _claimed_ports.get(port, self) is not self:
+                return False
+            if self.port != port and _claimed_ports.get(self.port) is self:
+                del _claimed_ports[self.port]
+            _claimed_ports[port] = self
+            return True
+
+    def load_cached_port(self):
+        try:
+            with open(PORT_CACHE_PATH) as f:
+                return json.load(f).get(self.cache_key)
+        except (OSError, ValueError):
+            return None
+
+    def save_cached_port(self):
+        try:
+            try:
+                with open(PORT_CACHE_PATH) as f:
+                    cache = json.load(f)
+            except (OSError, ValueError):
+                cache = {}
+            cache[self.cache_key] = self.port
+            with open(PORT_CACHE_PATH, 'w') as f:
+                json.dump(cache, f)
+        except OSError as e:
+            print(f"Could not save port cache: {e}")
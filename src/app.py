@@ -1,37 +1,111 @@
 from concurrent.futures import thread
 import os
-from flask import Flask, render_template, url_for, request, redirect, jsonify
+from flask import Flask, render_template, url_for, request, redirect, jsonify, Response, g, abort
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import delete, event, func, inspect, text, update
 from datetime import datetime, time
 from ESPEC import SH241
+from BusManager import BusManager
+from Tasks import TaskKind
+from Metrics import MetricSet, PrometheusText
+import asyncio
 import threading
 import webbrowser
 import time
-
-oven = SH241(address=1)
-oven.OpenChannel()
-
-oven_status = {
-    "task_name": "Task",
-    "mode": "STANDBY",
-    "temp": 0,
-    "state": "IDLE",
-    "task_done": False,
-}   
-
+import json
+import zlib
+import csv
+import io
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 db_path = os.path.join(basedir, 'test.db')
+telemetry_path = os.path.join(basedir, 'telemetry')
+
+#Id of the chamber when no registry file is given; the routes without a chamber in the path use the first chamber
+DEFAULT_CHAMBER = "default"
+#Each chamber on a shared RS-485 line is polled every BUS_POLL_INTERVAL seconds
+BUS_POLL_INTERVAL = 3.0
 
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + db_path
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
-current_task = None
-oven_thread = None
-task_started = False
+
+#Applied to every new SQLite connection: WAL lets the status routes read while a queue edit is being written, and
+#synchronous=NORMAL only syncs the log at checkpoints instead of on every commit
+def configure_sqlite(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+with app.app_context():
+    event.listen(db.engine, "connect", configure_sqlite)
+
 oven_connected = False
-cycle_id = 0 #keeps track of each half cycle to reset timer for cycling mode
+
+'''
+Holds the latest status snapshot and wakes up /api/stream clients when it changes.
+The snapshot is built once per change, however many clients are connected.
+'''
+class StatusBroadcaster:
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._version = 0
+        self._status = {}
+        self._async_waiters = set() #(event loop, asyncio.Event) of coroutines in wait_async
+
+    def publish(self, status):
+        with self._condition:
+            if status == self._status:
+                return
+            self._status = status
+            self._version += 1
+            self._condition.notify_all()
+            for loop, event in self._async_waiters:
+                loop.call_soon_threadsafe(event.set)
+
+    #Blocks until the snapshot is newer than version (or timeout passes) and returns (version, status)
+    def wait(self, version, timeout=None):
+        with self._condition:
+            self._condition.wait_for(lambda: self._version != version, timeout)
+            return self._version, self._status
+
+    #Same as wait for coroutines (see asgi.py), without holding a thread while waiting
+    async def wait_async(self, version, timeout=None):
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._condition:
+            if self._version != version:
+                return self._version, self._status
+            self._async_waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._condition:
+                self._async_waiters.discard(waiter)
+        with self._condition:
+            return self._version, self._status
+
+#Fields of status that differ from the last sent snapshot, with removed fields as None
+def status_delta(sent, status):
+    delta = {key: value for key, value in status.items() if key not in sent or sent[key] != value}
+    delta.update({key: None for key in sent if key not in status})
+    return delta
+
+#Time spent in each route, including database work, for /api/metrics
+request_metrics = MetricSet("espec_http_request_duration_seconds", "endpoint", "Time spent handling web requests.")
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    if 'request_started' in g:
+        request_metrics.observe(request.endpoint or "unknown", time.perf_counter() - g.request_started)
+    return response
 
 class TaskList(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -45,22 +119,396 @@ class TaskList(db.Model):
     date_created = db.Column(db.DateTime, default=datetime.utcnow)
     cycles = db.Column(db.Integer, default=0) #For cycling mode
     currCycles = db.Column(db.Integer, default=1)
+    position = db.Column(db.Integer, default=0) #Queue order, lowest runs first
+    chamber_id = db.Column(db.String(50), default=DEFAULT_CHAMBER) #Chamber whose queue the task is in
+    #Every queue query filters on the chamber and sorts by position, so both come from one index
+    __table_args__ = (db.Index('ix_task_list_chamber_position', 'chamber_id', 'position'),)
+
+'''
+Brings an existing database up to the current schema without losing its rows: creates missing tables, adds columns
+that were added to the models since the file was created, and creates missing indexes.
+'''
+def migrate_database():
+    db.create_all()
+    inspector = inspect(db.engine)
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    connection.execute(text('ALTER TABLE %s ADD COLUMN %s %s' % (table.name, column.name, column.type.compile(db.engine.dialect))))
+                    print(f"DATABASE LOG: Added column {table.name}.{column.name}")
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+        #Rows from before the position column keep their insertion order, rows from before chamber_id belong to
+        #the default chamber
+        connection.execute(text('UPDATE task_list SET position = id WHERE position IS NULL'))
+        connection.execute(text('UPDATE task_list SET chamber_id = :chamber WHERE chamber_id IS NULL'), {"chamber": default_chamber_id})
+
+'''
+One chamber of the registry: its SH241, the task it is running and the cached copy of its queue.
+Every chamber has its own task engine, journal, telemetry run and status stream, and its own rows in TaskList.
+'''
+class Chamber:
+    def __init__(self, chamber_id, oven, port=None, address=1):
+        self.id = chamber_id
+        self.oven = oven
+        self.port = port
+        self.address = address
+        self.current_task = None
+        self.oven_thread = None
+        self.task_started = False
+        self.cycle_id = 0 #keeps track of each half cycle to reset timer for cycling mode
+        self.status_broadcaster = StatusBroadcaster()
+        #In-memory copy of the queued tasks. Rebuilt from the database only after a route edits the queue;
+        #queue_version increases on every edit so clients can tell whether their copy is current.
+        self.queue_lock = threading.Lock()
+        self.queue_version = 0
+        self.queue_snapshot = None
+        #The default chamber keeps the file names used before there was a registry
+        suffix = "" if chamber_id == DEFAULT_CHAMBER else "-" + chamber_id
+        self.journal_path = os.path.join(basedir, 'journal%s.jsonl' % suffix)
+        self.telemetry_name = None if chamber_id == DEFAULT_CHAMBER else 'chamber' + suffix
+        oven.AddStatusListener(self.publish_status)
+
+    #Queued rows of this chamber in run order
+    def tasks(self):
+        return TaskList.query.filter_by(chamber_id=self.id).order_by(TaskList.position, TaskList.id)
+
+    #Position after the last queued task; max() over the chamber's index range is a single index lookup
+    def next_position(self):
+        return (db.session.query(func.max(TaskList.position)).filter(TaskList.chamber_id == self.id).scalar() or 0) + 1
+
+    def invalidate_queue(self):
+        with self.queue_lock:
+            self.queue_version += 1
+            self.queue_snapshot = None
+
+    #Returns (version, list of queued task dictionaries), reading the database only if the cache was invalidated
+    def get_queue_snapshot(self):
+        with self.queue_lock:
+            if self.queue_snapshot is None:
+                self.queue_snapshot = [{
+                    "id": t.id,
+                    "type": t.type,
+                    "temp": t.temp,
+                    "temp1": t.temp1 if t.type == "Cycle" else None,
+                    "hour": t.hour,
+                    "min": t.min,
+                    "sec": t.sec,
+                    "cycles": t.cycles if t.type == "Cycle" else None
+                } for t in self.tasks().all()]
+            return self.queue_version, self.queue_snapshot
+
+    #Rebuilds the status snapshot and pushes it to stream clients if anything changed
+    def publish_status(self):
+        with app.app_context():
+            status = self.build_status()
+            status.pop("queue_version")
+            self.status_broadcaster.publish(status)
+
+    #Builds the status dictionary served by /api/status and /api/stream
+    def build_status(self):
+        oven = self.oven
+        current_task = self.current_task
+
+        # 1. If the queue is empty or no task is loaded
+        version, queue_data = self.get_queue_snapshot()
+        monitor = oven.monitor
+
+        if current_task is None:
+            return {
+                "state": "IDLE",
+                "start_time": -1,
+                "duration": 0,
+                "temperature": oven.temperature if hasattr(oven, 'temperature') else "-",
+                "type": "None",
+                "id": -1,
+                "humidity": monitor.humidity,
+                "alarms": monitor.alarms,
+                "chamber_mode": monitor.mode,
+                "queue": queue_data,
+                "queue_version": version
+            }
+
+        # 2. Calculate the total duration in seconds safely
+        # (Assuming current_task is a dictionary. If it's an object, use current_task.hour instead)
+        total_seconds = (current_task.hour * 3600) + \
+                        (current_task.min * 60) + \
+                        current_task.sec
+
+        # 3. Send back the live facts
+        return {
+            "state": oven.state,  # Make sure this points to your oven's live hardware state
+            "start_time": current_task.start_time if hasattr(current_task, 'start_time') else -1,
+            "duration": total_seconds,
+            "hour": current_task.hour if hasattr(current_task, 'hour') else 0,
+            "min": current_task.min if hasattr(current_task, 'min') else 0,
+            "sec": current_task.sec if hasattr(current_task, 'sec') else 0,
+            "temperature": oven.temperature if hasattr(oven, 'temperature') else "-",
+            "set_temp": current_task.temp if hasattr(current_task, 'temp') else -1,
+            "set_temp1": current_task.temp1 if hasattr(current_task, 'temp1') else -1,
+            "cycles": current_task.cycles if hasattr(current_task, 'cycles') else -1,
+            "currCycles": oven.currentCycle,
+            "type": current_task.type if hasattr(current_task, 'type') else "None",
+            "id": current_task.id if hasattr(current_task, 'id') else -1,
+            "humidity": monitor.humidity,
+            "alarms": monitor.alarms,
+            "chamber_mode": monitor.mode,
+            "queue": queue_data,
+            "queue_version": version
+        }
+
+    #One line of the /api/chambers overview, built from memory without touching the bus
+    def summary(self):
+        version, queue_data = self.get_queue_snapshot()
+        return {
+            "id": self.id,
+            "port": self.port,
+            "address": self.address,
+            "state": self.oven.state if self.current_task else "IDLE",
+            "mode": self.oven.mode,
+            "temperature": self.oven.temperature,
+            "target_temperature": self.oven.target_temperature,
+            "chamber_mode": self.oven.monitor.mode,
+            "alarms": self.oven.monitor.alarms,
+            "task": self.current_task.type if self.current_task else None,
+            "task_id": self.current_task.id if self.current_task else None,
+            "queued": len(queue_data),
+            "queue_version": version,
+        }
+
+    #Takes the next queued row off the database and starts it in the oven; returns the route's reply
+    def start_next_task(self):
+        with app.app_context():
+            #The next task is the lowest position, read from the index in the same query that fetches it
+            task_to_start = self.tasks().first()
+            if task_to_start is None:
+                self.current_task = None
+                self.task_started = False
+                return "No tasks in the database to start."
+            try:
+                self.current_task = task_to_start
+                self.current_task.start_time = -1  # Initialize start_time to -1 to indicate it hasn't started yet
+                db.session.delete(task_to_start)
+                db.session.commit()
+                self.invalidate_queue()
+                self.publish_status()
+                if self.task_started == False:
+                    self.oven_thread = threading.Thread(target=self.oven.startTask)
+                    self.oven_thread.start()
+                    self.task_started = True
+                else:
+                    return "Oven is already running a task. Cannot start another one until it's done."
+                return "Task Started", 200
+
+            except Exception as e:
+                return f'There was a problem starting the task: {e}'
+
+    '''
+    Runs the whole queue from the controller's program memory (see SH241.RunTaskListOnController) instead of step by
+    step from the host. The queued rows are taken off the database together and current_task becomes a "Program"
+    entry covering all of them; the program's end is picked up by update() like the end of a task.
+    '''
+    def start_program(self):
+        with app.app_context():
+            if self.task_started:
+                return "Oven is already running a task. Cannot start another one until it's done."
+            rows = self.tasks().all()
+            if not rows:
+                return "No tasks in the database to start."
+            try:
+                self.oven.RunTaskListOnController()
+            except (ValueError, IOError) as e:
+                return f'There was a problem starting the program: {e}', 400
+            seconds = sum((row.hour * 3600 + row.min * 60 + row.sec) * (2 * row.cycles if row.type == "Cycle" else 1) for row in rows)
+            self.current_task = TaskList(id=-1, type="Program", temp=rows[0].temp, temp1=rows[0].temp1, cycles=0,
+                                         hour=seconds // 3600, min=seconds % 3600 // 60, sec=seconds % 60, chamber_id=self.id)
+            self.current_task.start_time = datetime.now().timestamp()
+            for row in rows:
+                db.session.delete(row)
+            db.session.commit()
+            self.task_started = True
+            self.invalidate_queue()
+            self.publish_status()
+            return "Program Started", 200
+
+    def stop_task(self):
+        self.current_task = None
+        self.oven.stopTask()
+        self.oven_thread = None
+        self.task_started = False
+        self.publish_status()
+
+    #Advances the chamber's task bookkeeping; called by update_status_loop once a second
+    def update(self, task_done):
+        if task_done:
+            self.current_task = None
+            self.oven.task_done = False
+            self.start_next_task()
+
+        if self.oven.halfCycle != self.cycle_id and self.current_task:
+            self.current_task.start_time = -1
+            self.cycle_id = self.oven.halfCycle
+            self.publish_status()
+
+        if self.oven.state == "SOAKING" and self.current_task and self.current_task.start_time == -1:
+            self.current_task.start_time = datetime.now().timestamp()
+            self.publish_status()
+
+    '''
+    Picks up the run the previous process was executing: the rows still in the database are queued in the oven
+    again and the oven continues the journaled step. The running task's row was deleted when it started, so
+    current_task is rebuilt from the journal.
+    '''
+    def resume_run(self):
+        oven = self.oven
+        oven.LoadProfile([profile_entry(row) for row in self.tasks().all()])
+        run = oven.ResumeFromJournal()
+        if run is None:
+            return
+        task = run["task"]
+        seconds = task["duration"]
+        self.current_task = TaskList(id=task["db_id"] if isinstance(task["db_id"], int) else -1, type=task["kind"],
+                                     temp=task.get("temp1", task["temp"]), temp1=task.get("temp2", 0), cycles=task.get("cycles", 0),
+                                     hour=seconds // 3600, min=seconds % 3600 // 60, sec=seconds % 60, chamber_id=self.id)
+        self.current_task.start_time = run["reached"] if run["phase"] == "soak" else -1
+        self.task_started = True
+        self.cycle_id = oven.halfCycle
+        self.invalidate_queue()
+        self.publish_status()
+
+    #Continues a journaled run (the queue is kept), otherwise starts from an empty queue
+    def restore(self):
+        if self.oven.journal is None:
+            self.oven.StartJournal(self.journal_path)
+        if self.oven.journal.replay() is not None:
+            try:
+                self.resume_run()
+            except Exception as e:
+                print(f"Resume Error ({self.id}): {e}")
+        else:
+            try:
+                num_deleted = TaskList.query.filter_by(chamber_id=self.id).delete()
+                db.session.commit()
+                self.invalidate_queue()
+                print(f"Startup Cleanup ({self.id}): Deleted {num_deleted} old tasks from the database.")
+            except Exception as e:
+                print(f"Cleanup Error ({self.id}): {e}")
+                db.session.rollback()
+        #Keep the temperature ramp data of this run
+        if self.telemetry_name is None:
+            self.oven.StartRecording(telemetry_path)
+        else:
+            self.oven.StartRecording(telemetry_path, name=self.telemetry_name)
+
+    #Stops the chamber before the process exits, keeping the journal so an unfinished run can resume
+    def shutdown(self):
+        try:
+            if oven_connected:
+                self.oven.stopTask()
+        except Exception as e:
+            print(f"Could not stop oven {self.id}: {e}")
+        self.oven.StopRecording()
+        self.oven.StopJournal()
+
+'''
+Reads the chamber registry, a JSON list of {"id": "...", "port": "...", "address": 1} entries, from the file named
+by ESPEC_CHAMBERS (default chambers.json next to this file). Without the file there is a single chamber,
+DEFAULT_CHAMBER, at address 1 on ESPEC_PORT, which skips port detection, e.g. ESPEC_PORT=sim://app to run against
+the simulator (see Simulator.py).
+'''
+def load_chamber_config():
+    path = os.environ.get('ESPEC_CHAMBERS', os.path.join(basedir, 'chambers.json'))
+    if not os.path.exists(path):
+        return [{"id": DEFAULT_CHAMBER, "port": os.environ.get('ESPEC_PORT'), "address": 1}]
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"{path}: expected a list of chambers")
+    config = []
+    for entry in entries:
+        chamber = {"id": str(entry["id"]), "port": entry.get("port"), "address": int(entry.get("address", 1))}
+        if any(other["id"] == chamber["id"] for other in config):
+            raise ValueError(f"{path}: chamber id {chamber['id']} is used twice")
+        config.append(chamber)
+    return config
+
+'''
+Creates a Chamber per registry entry. Chambers that share a port are driven by one BusManager, which owns the port
+and polls them round-robin from a single thread; a chamber alone on its port gets its own SH241 as before.
+Each SH241 runs its task deadlines on its own engine thread, so a chamber that stops answering only delays itself
+(see bench_chambers.py).
+Returns the bus managers, which OpenChambers opens.
+'''
+def create_chambers(config):
+    buses = []
+    by_port = {}
+    for entry in config:
+        #Chambers without a port autodetect their own
+        key = entry["port"] if entry["port"] is not None else ("autodetect", entry["id"])
+        by_port.setdefault(key, []).append(entry)
+    for port, members in by_port.items():
+        if len(members) > 1:
+            addresses = [entry["address"] for entry in members]
+            if len(set(addresses)) != len(addresses):
+                raise ValueError(f"Chambers on {port} share an address")
+            bus = BusManager(port, addresses, poll_rate=len(members) / BUS_POLL_INTERVAL)
+            buses.append(bus)
+            ovens = [bus.Chamber(address) for address in addresses]
+        else:
+            #An autodetected port is cached per chamber; the default chamber keeps the address key used before
+            entry = members[0]
+            ovens = [SH241(address=entry["address"], port=entry["port"],
+                           cache_key=None if entry["id"] == DEFAULT_CHAMBER else entry["id"])]
+        for entry, oven in zip(members, ovens):
+            chambers[entry["id"]] = Chamber(entry["id"], oven, entry["port"], entry["address"])
+    return buses
+
+def open_chambers(buses):
+    #Journals first, so a chamber with a run to resume is not put in standby when it is opened
+    for chamber in chambers.values():
+        chamber.oven.StartJournal(chamber.journal_path)
+    for bus in buses:
+        bus.Open()
+    shared = {id(oven) for bus in buses for oven in bus.chambers.values()}
+    for chamber in chambers.values():
+        if id(chamber.oven) not in shared:
+            chamber.oven.OpenChannel()
+
+#Chamber of a route's <chamber_id>, or the default chamber for the routes without one
+def get_chamber(chamber_id=None):
+    chamber = chambers.get(default_chamber_id if chamber_id is None else chamber_id)
+    if chamber is None:
+        abort(404, description=f"Unknown chamber {chamber_id}")
+    return chamber
+
+chambers = {}
+chamber_config = load_chamber_config()
+default_chamber_id = chamber_config[0]["id"]
+chamber_buses = create_chambers(chamber_config)
+open_chambers(chamber_buses)
 
 @app.route('/', methods=['POST', 'GET'])
 def index():
-    tasks = TaskList.query.order_by(TaskList.date_created).all()
-    return render_template('index.html', tasks=tasks, current_task=current_task)
+    chamber = get_chamber()
+    tasks = chamber.tasks().all()
+    return render_template('index.html', tasks=tasks, current_task=chamber.current_task)
 
 @app.route('/cycle', methods=['POST', 'GET'])
 def cycle():
-    tasks = TaskList.query.order_by(TaskList.date_created).all()
-    return render_template('cycling mode.html', tasks=tasks, current_task=current_task)
+    chamber = get_chamber()
+    tasks = chamber.tasks().all()
+    return render_template('cycling mode.html', tasks=tasks, current_task=chamber.current_task)
 
+#Every /api/... route below that acts on a chamber is also served as /api/<chamber_id>/...
 @app.route('/api/add_task', methods=['POST', 'GET'])
-def add_task_route():
+@app.route('/api/<chamber_id>/add_task', methods=['POST', 'GET'])
+def add_task_route(chamber_id=None):
+    chamber = get_chamber(chamber_id)
     if request.method == 'GET':
-        tasks = TaskList.query.order_by(TaskList.date_created).all()
-        return render_template('index.html', tasks=tasks, current_task=current_task)
+        tasks = chamber.tasks().all()
+        return render_template('index.html', tasks=tasks, current_task=chamber.current_task)
 
     if request.method == 'POST':
         try:
@@ -77,12 +525,14 @@ def add_task_route():
                     t_s = int(data.get('seconds', 0))
 
                     #Add to DATABASE (Logging)
-                    new_db_task = TaskList(temp=t_temp, hour=t_h, min=t_m, sec=t_s, type="Task")
+                    new_db_task = TaskList(temp=t_temp, hour=t_h, min=t_m, sec=t_s, type="Task", position=chamber.next_position(), chamber_id=chamber.id)
                     db.session.add(new_db_task)
                     db.session.commit()
+                    chamber.invalidate_queue()
                     
                     #Send to Oven
-                    oven.AddTask(t_temp, t_h, t_m, t_s, taskname="Task", db_id=new_db_task.id)
+                    chamber.oven.AddTask(t_temp, t_h, t_m, t_s, taskname="Task", db_id=new_db_task.id)
+                    chamber.publish_status()
 
                     return jsonify({"status": "success", "message": "Task added to Oven & DB"})
                 
@@ -97,12 +547,14 @@ def add_task_route():
                     t_cycles = int(data.get('cycles', 1))
 
                     #Add to DATABASE (Logging)
-                    new_db_task = TaskList(temp=t_temp1, temp1=t_temp2, cycles=t_cycles, hour=t_h, min=t_m, sec=t_s, type="Cycle")
+                    new_db_task = TaskList(temp=t_temp1, temp1=t_temp2, cycles=t_cycles, hour=t_h, min=t_m, sec=t_s, type="Cycle", position=chamber.next_position(), chamber_id=chamber.id)
                     db.session.add(new_db_task)
                     db.session.commit()
+                    chamber.invalidate_queue()
                     
                     #Send to Oven
-                    oven.AddCycle(t_temp1, t_temp2, t_h, t_m, t_s, t_cycles, taskname="Cycle", db_id=new_db_task.id)
+                    chamber.oven.AddCycle(t_temp1, t_temp2, t_h, t_m, t_s, t_cycles, taskname="Cycle", db_id=new_db_task.id)
+                    chamber.publish_status()
 
                     return jsonify({"status": "success", "message": "Cycle Task added to Oven & DB"})
 
@@ -114,185 +566,283 @@ def add_task_route():
             print(f"Error: {e}")
             return jsonify({"status": "error", "message": str(e)}), 400
         
+'''
+Reads a profile upload: a JSON list of /api/add_task style objects (or {"tasks": [...]}), or CSV with a header row
+using the same field names (mode,temp,temp1,temp2,hours,minutes,seconds,cycles), as the body or a "file" upload.
+'''
+def parse_profile_upload():
+    if request.is_json:
+        data = request.get_json()
+        entries = data.get('tasks') if isinstance(data, dict) else data
+        if not isinstance(entries, list):
+            raise ValueError("Expected a list of tasks")
+        return entries
+    upload = request.files.get('file')
+    text = upload.read().decode('utf-8-sig') if upload else request.get_data(as_text=True)
+    #Empty CSV cells fall back to the defaults of each field
+    return [{key.strip(): value.strip() for key, value in row.items() if key and value and value.strip()}
+            for row in csv.DictReader(io.StringIO(text))]
+
+#Database row for a parsed Task/Cycle record, in the same layout add_task_route uses
+def task_row(task, position, chamber_id):
+    if task.kind is TaskKind.CYCLE:
+        return TaskList(temp=task.temp1, temp1=task.temp2, cycles=task.totalCycles, hour=task.hours, min=task.minutes, sec=task.seconds, type="Cycle", position=position, chamber_id=chamber_id)
+    return TaskList(temp=task.temp, hour=task.hours, min=task.minutes, sec=task.seconds, type=task.taskName, position=position, chamber_id=chamber_id)
+
+'''
+Imports a whole profile in one request: every step is validated first, then all rows are written in a single
+transaction and queued in the oven together. /api/add_tasks is the same route for JSON clients adding many tasks.
+'''
+@app.route('/api/import', methods=['POST'])
+@app.route('/api/add_tasks', methods=['POST'])
+@app.route('/api/<chamber_id>/import', methods=['POST'])
+@app.route('/api/<chamber_id>/add_tasks', methods=['POST'])
+def import_profile_route(chamber_id=None):
+    chamber = get_chamber(chamber_id)
+    try:
+        tasks = chamber.oven.ParseProfile(parse_profile_upload())
+        first = chamber.next_position()
+        rows = [task_row(task, first + n, chamber.id) for n, task in enumerate(tasks)]
+        db.session.add_all(rows)
+        db.session.flush()
+        for task, row in zip(tasks, rows):
+            task.db_id = row.id
+        db.session.commit()
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 400
+    chamber.oven.LoadProfile(tasks)
+    chamber.invalidate_queue()
+    chamber.publish_status()
+    return jsonify({"status": "success", "message": f"Imported {len(tasks)} tasks to Oven & DB"})
+
 @app.route('/api/delete/<int:id>')
-def del_task_route(id):
+@app.route('/api/<chamber_id>/delete/<int:id>')
+def del_task_route(id, chamber_id=None):
+    chamber = get_chamber(chamber_id)
     #Tries to get taskid
-    task_to_delete = TaskList.query.get_or_404(id)
+    task_to_delete = TaskList.query.filter_by(id=id, chamber_id=chamber.id).first_or_404()
     try:
         db.session.delete(task_to_delete)
         db.session.commit()
-        oven.deleteTask(id)
+        chamber.invalidate_queue()
+        chamber.oven.deleteTask(id)
+        chamber.publish_status()
         return redirect('/')
     except Exception as e:
         print(f"CRITICAL ERROR: {e}") 
         return f'There was a problem deleting that task: {e}'
     
+#Reads the {"ids": [...]} body of the batch routes
+def task_ids_from_request():
+    data = request.get_json(silent=True)
+    ids = data.get('ids') if isinstance(data, dict) else None
+    if not isinstance(ids, list):
+        raise ValueError('Expected {"ids": [...]}')
+    return [int(task_id) for task_id in ids]
+
+#Deletes every task in {"ids": [...]} with one DELETE statement and one commit; unknown ids are ignored
+@app.route('/api/delete_tasks', methods=['POST'])
+@app.route('/api/<chamber_id>/delete_tasks', methods=['POST'])
+def delete_tasks_route(chamber_id=None):
+    chamber = get_chamber(chamber_id)
+    try:
+        ids = task_ids_from_request()
+    except (TypeError, ValueError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    #Only tasks removed from this chamber's queue are removed from the oven
+    deleted = [task_id for (task_id,) in db.session.execute(
+        delete(TaskList).where(TaskList.chamber_id == chamber.id, TaskList.id.in_(ids)).returning(TaskList.id))]
+    db.session.commit()
+    chamber.invalidate_queue()
+    for task_id in deleted:
+        chamber.oven.deleteTask(task_id)
+    chamber.publish_status()
+    return jsonify({"status": "success", "message": f"Deleted {len(deleted)} tasks from Oven & DB"})
+
+'''
+Reorders the queue in one transaction. The tasks in {"ids": [...]} move to the end of the queue in the given order,
+so sending every queued id sets the whole order. Ids that are no longer queued are ignored.
+'''
+@app.route('/api/reorder', methods=['POST'])
+@app.route('/api/<chamber_id>/reorder', methods=['POST'])
+def reorder_tasks_route(chamber_id=None):
+    chamber = get_chamber(chamber_id)
+    try:
+        ids = task_ids_from_request()
+    except (TypeError, ValueError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    queued = {task_id for (task_id,) in db.session.query(TaskList.id).filter(TaskList.chamber_id == chamber.id, TaskList.id.in_(ids))}
+    ids = [task_id for task_id in dict.fromkeys(ids) if task_id in queued]
+    first = chamber.next_position()
+    if ids:
+        db.session.execute(update(TaskList), [{"id": task_id, "position": first + n} for n, task_id in enumerate(ids)])
+    db.session.commit()
+    chamber.invalidate_queue()
+    for task_id in ids:
+        chamber.oven.moveTask(task_id)
+    chamber.publish_status()
+    return jsonify({"status": "success", "message": f"Reordered {len(ids)} tasks"})
+
+#?mode=program runs the whole queue from the controller's program memory instead of task by task
 @app.route('/api/start')
-def start_task_route():
-    global current_task
-    global task_started
-    global oven_thread
-    with app.app_context():
-        if db.session.query(TaskList).count() == 0:
-            current_task = None
-            task_started = False
-            return "No tasks in the database to start."
-        try:
-            task_to_start = db.session.query(TaskList).first()
-            current_task = task_to_start
-            current_task.start_time = -1  # Initialize start_time to -1 to indicate it hasn't started yet
-            db.session.delete(task_to_start)
-            db.session.commit()
-            if task_started == False:
-                oven_thread = threading.Thread(target=oven.startTask)
-                oven_thread.start()
-                task_started = True
-            else:
-                return "Oven is already running a task. Cannot start another one until it's done."
-            return "Task Started", 200
-        
-        except Exception as e:
-            return f'There was a problem starting the task: {e}'
+@app.route('/api/<chamber_id>/start')
+def start_task_route(chamber_id=None):
+    chamber = get_chamber(chamber_id)
+    if request.args.get('mode') == 'program':
+        return chamber.start_program()
+    return chamber.start_next_task()
     
 @app.route('/api/stop')
-def stop_task_route():
-    global current_task
-    if current_task is None:
+@app.route('/api/<chamber_id>/stop')
+def stop_task_route(chamber_id=None):
+    chamber = get_chamber(chamber_id)
+    if chamber.current_task is None:
         return "No tasks in the database to stop."
     
     try:
-        global oven_thread
-        global task_started
-        current_task = None
-        oven.stopTask()
-        oven_thread = None
-        task_started = False
+        chamber.stop_task()
         return redirect('/')
     except Exception as e:
         return f'There was a problem stopping the task: {e}' 
     
 @app.route('/api/rs232')
-def switch_to_rs232():
+@app.route('/api/<chamber_id>/rs232')
+def switch_to_rs232(chamber_id=None):
+    chamber = get_chamber(chamber_id)
     try:
-        oven.SetRS32()
+        chamber.oven.SetRS32()
         return "Switched to RS232 mode."
     except Exception as e:
         return f'Error switching to RS232 mode: {e}'
 
 @app.route('/api/rs485')
-def switch_to_rs485():
+@app.route('/api/<chamber_id>/rs485')
+def switch_to_rs485(chamber_id=None):
+    chamber = get_chamber(chamber_id)
     try:
-        oven.SetRS485()
+        chamber.oven.SetRS485()
         return "Switched to RS485 mode."
     except Exception as e:
         return f'Error switching to RS485 mode: {e}'
 
-def update_status_loop():
+#Stops every chamber before the process exits
+def shutdown_chambers():
+    for chamber in chambers.values():
+        chamber.shutdown()
+
+#One thread advances the task bookkeeping of every chamber, however many there are
+def update_status_loop(watch_heartbeat=True):
     while True:
-        oven_status['mode'] = oven.mode
-        oven_status["temp"] = oven.temperature
-        oven_status["state"] = oven.state
-        oven_status["task_done"] = oven.task_done
+        #Read before the wait, like the status the chambers had at the start of this second
+        done = {chamber.id: chamber.oven.task_done for chamber in chambers.values()}
         
         #Check for heartbeat every 1 second to fix server not closing after browser close bug
         global last_heartbeat
         #70s leeway
-        if time.time() - last_heartbeat > 70:
+        if watch_heartbeat and time.time() - last_heartbeat > 70:
             print("Browser closed or lost connection! Shutting down...")
             
-            #Safely stop the oven before quitting
-            try:
-                if 'oven_connected' in globals() and oven_connected:
-                    oven.stopTask()
-            except:
-                pass
+            #Safely stop the ovens before quitting
+            shutdown_chambers()
                 
             #Kill the invisible background server
             os._exit(0)
             
         threading.Event().wait(1)  # Update every 1 seconds
-        global current_task
-        global task_started
         
-        if oven_status["task_done"]:
-            current_task = None
-            oven.task_done = False
-            start_task_route()
-            
-        global cycle_id
-        if oven.halfCycle != cycle_id and current_task:
-            current_task.start_time = -1
-            cycle_id = oven.halfCycle
-            
-        if oven_status["state"] == "SOAKING" and current_task and current_task.start_time == -1:
-            current_task.start_time = datetime.now().timestamp()
-            
+        for chamber in chambers.values():
+            try:
+                chamber.update(done[chamber.id])
+            except Exception as e:
+                print(f"Error updating chamber {chamber.id}: {e}")
 
+'''
+Returns the live status. The ETag combines the queue version with a checksum of the other fields, so a poll with
+a matching If-None-Match gets an empty 304 without the queue being rebuilt or serialized.
+'''
 @app.route('/api/status')
-def get_status():
-    global current_task
-    
-    # 1. If the queue is empty or no task is loaded
-    queue = db.session.query(TaskList).all()
-    
-    queue_data = []
-    for t in queue:
-        queue_data.append({
-            "id": t.id,
-            "type": t.type,
-            "temp": t.temp,
-            "temp1": t.temp1 if t.type == "Cycle" else None,
-            "hour": t.hour,
-            "min": t.min,
-            "sec": t.sec,
-            "cycles": t.cycles if t.type == "Cycle" else None
-        })
-    
-    if current_task is None:
-        return jsonify({
-            "state": "IDLE", 
-            "start_time": -1, 
-            "duration": 0,
-            "temperature": oven.temperature if hasattr(oven, 'temperature') else "-",
-            "type": "None",
-            "id": -1,
-            "queue": queue_data
-        })
-    
-    # 2. Calculate the total duration in seconds safely
-    # (Assuming current_task is a dictionary. If it's an object, use current_task.hour instead)
-    total_seconds = (current_task.hour * 3600) + \
-                    (current_task.min * 60) + \
-                    current_task.sec
+@app.route('/api/<chamber_id>/status')
+def get_status(chamber_id=None):
+    status = get_chamber(chamber_id).build_status()
+    version = status.pop("queue_version")
+    live_fields = {key: value for key, value in status.items() if key != "queue"}
+    etag = "%i-%08x" % (version, zlib.crc32(json.dumps(live_fields, sort_keys=True, default=str).encode()))
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = jsonify(status)
+    #no-cache makes browsers revalidate every poll, answering fetch() from their cache on a 304
+    response.headers['Cache-Control'] = 'no-cache'
+    response.set_etag(etag)
+    return response
+
+'''
+Pushes status updates as server-sent events. The first event is the full status; after that each event only
+carries the fields that changed (removed fields are sent as null). A comment line is sent every 15s as keepalive.
+Under asgi.py the same stream is served by an async endpoint instead, so an open stream does not hold a thread.
+'''
+@app.route('/api/stream')
+@app.route('/api/<chamber_id>/stream')
+def stream_status(chamber_id=None):
+    chamber = get_chamber(chamber_id)
+    chamber.publish_status()
+    def events():
+        version = -1
+        sent = {}
+        while True:
+            version, status = chamber.status_broadcaster.wait(version, timeout=15)
+            delta = status_delta(sent, status)
+            if delta:
+                sent = status
+                yield f"data: {json.dumps(delta)}\n\n"
+            else:
+                yield ": keepalive\n\n"
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+'''
+Overview of every chamber in the registry for a dashboard: id, port, address, live temperature and mode, the running
+task and the queue length. Served from memory (last poll and cached queue), so polling it costs no serial traffic.
+'''
+@app.route('/api/chambers')
+def get_chambers():
+    return jsonify({"default": default_chamber_id, "chambers": [chamber.summary() for chamber in chambers.values()]})
     
-    # 3. Send back the live facts
-    return jsonify({
-        "state": oven.state,  # Make sure this points to your oven's live hardware state
-        "start_time": current_task.start_time if hasattr(current_task, 'start_time') else -1,
-        "duration": total_seconds,
-        "hour": current_task.hour if hasattr(current_task, 'hour') else 0,
-        "min": current_task.min if hasattr(current_task, 'min') else 0,
-        "sec": current_task.sec if hasattr(current_task, 'sec') else 0,
-        "temperature": oven.temperature if hasattr(oven, 'temperature') else "-",
-        "set_temp": current_task.temp if hasattr(current_task, 'temp') else -1,
-        "set_temp1": current_task.temp1 if hasattr(current_task, 'temp1') else -1,
-        "cycles": current_task.cycles if hasattr(current_task, 'cycles') else -1,
-        "currCycles": oven.currentCycle,
-        "type": current_task.type if hasattr(current_task, 'type') else "None",
-        "id": current_task.id if hasattr(current_task, 'id') else -1,
-        "queue": queue_data
-    })
+'''
+Returns the recorded temperature of the current run for plotting, decimated to the requested width.
+Query parameters: start, end (unix seconds, default the last hour) and width (number of points, default 500).
+Each point is [time, min PV, max PV, mean PV, mean SV].
+'''
+@app.route('/api/history')
+@app.route('/api/<chamber_id>/history')
+def get_history(chamber_id=None):
+    oven = get_chamber(chamber_id).oven
+    try:
+        end = float(request.args.get('end', time.time()))
+        start = float(request.args.get('start', end - 3600))
+        width = min(int(request.args.get('width', 500)), 5000)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if oven.recorder is None:
+        return jsonify({"resolution": 0, "points": []})
+    resolution, points = oven.recorder.history.query(start, end, width)
+    return jsonify({"resolution": resolution, "points": points})
     
+#Serial command and web request metrics in the Prometheus text format, once per port however many chambers share it
+@app.route('/api/metrics')
+def get_metrics():
+    sources = {}
+    for chamber in chambers.values():
+        metrics, labels = chamber.oven.GetCommandMetrics()
+        sources.setdefault(id(metrics), (metrics, labels))
+    return Response(PrometheusText(list(sources.values()) + [(request_metrics, {})]), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/shutdown')
 def shutdown_server():
     print("Shutting down the server...")
     
-    # Safety Check: Stop the oven before quitting!
-    try:
-        if oven_connected:
-            oven.stopTask()
-    except Exception as e:
-        print(f"Could not stop oven: {e}")
+    # Safety Check: Stop the ovens before quitting!
+    shutdown_chambers()
 
     # This instantly kills the invisible Python process and all background loops
     os._exit(0)
@@ -307,27 +857,46 @@ def heartbeat():
 
 
     
+#Profile entry (see SH241.LoadProfile) for a queued row
+def profile_entry(row):
+    entry = {"hours": row.hour, "minutes": row.min, "seconds": row.sec, "db_id": row.id}
+    if row.type == "Cycle":
+        entry.update(mode="cycle", temp1=row.temp, temp2=row.temp1, cycles=row.cycles)
+    else:
+        entry.update(mode="idle" if row.type == "Idle" else "soak", temp=row.temp)
+    return entry
+
 def open_browser():
     #This automatically opens the default web browser with the local server
     webbrowser.open_new("http://127.0.0.1:5000/")
     
     
-if __name__ == '__main__':
+server_started = False
+
+'''
+Gets the app ready to serve: migrates the database, lets every chamber resume or clean up its queue and starts the
+status loop. Called by __main__ and by asgi.py; calling it again does nothing.
+watch_heartbeat: Exit when the browser stops sending heartbeats. The desktop app needs it; a server started by an
+                 ASGI server does not.
+'''
+def start_server(watch_heartbeat=True):
+    global server_started
+    if server_started:
+        return
+    server_started = True
     with app.app_context():
         print(f"DATABASE LOG: Looking for DB at: {db_path}")
         
-        #Wipe it and recreate it to fix the 'type' column error
-        db.drop_all() 
-        db.create_all()
-        print("DATABASE LOG: Tables recreated successfully!")
-        try:
-            num_deleted = db.session.query(TaskList).delete()
-            db.session.commit()
-            print(f"Startup Cleanup: Deleted {num_deleted} old tasks from the database.")
-        except Exception as e:
-            print(f"Cleanup Error: {e}")
-            db.session.rollback()
-        update_status_loop_thread = threading.Thread(target=update_status_loop, daemon=True)
-        update_status_loop_thread.start()
-        threading.Timer(1, open_browser).start()  # Open browser after a short delay
-    app.run(debug=False)
\ No newline at end of file
+        #Add tables/columns the file is missing (e.g. the 'type' column) instead of wiping it
+        migrate_database()
+        print("DATABASE LOG: Schema is up to date!")
+        #Each chamber continues its own interrupted run or starts from an empty queue
+        for chamber in chambers.values():
+            chamber.restore()
+    update_status_loop_thread = threading.Thread(target=update_status_loop, args=(watch_heartbeat,), daemon=True)
+    update_status_loop_thread.start()
+    
+if __name__ == '__main__':
+    start_server()
+    threading.Timer(1, open_browser).start()  # Open browser after a short delay
+    app.run(debug=False)
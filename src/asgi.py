@@ -0,0 +1,98 @@
+'''asgi.py: ASGI entry point for the web interface.
+Serves the Flask app through an ASGI server, e.g.
+    uvicorn asgi:asgi_app
+Importing this module runs the same startup as app.py (database migration, run resume, status loop), without the
+browser heartbeat shutdown. app.py remains the entry point for the packaged executable.
+
+asgiref's WsgiToAsgi runs every view on one shared thread, so one slow request holds up all the others. Here each
+request runs on a pool of WSGI_THREADS threads instead, and /api/stream (the server-sent status events every page
+opens) is a native async endpoint: open streams wait on the event loop and hold no thread.
+Limits: Flask views are still synchronous. Each request in progress holds a pool thread, so at most WSGI_THREADS
+requests are served at once and the rest wait for a free thread. Views share the GIL. Chamber commands are serialized
+per port by the chamber's CommandBus whatever the number of threads.
+'''
+
+import asyncio
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgiInstance
+
+import app as web
+from app import app
+from app import start_server
+
+#Requests served at the same time; ESPEC_WSGI_THREADS overrides it
+WSGI_THREADS = int(os.environ.get('ESPEC_WSGI_THREADS', 32))
+
+_wsgi_pool = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix="wsgi")
+
+#The synchronous body of WsgiToAsgiInstance.run_wsgi_app, without asgiref's thread-sensitive wrapper
+_run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False, executor=_wsgi_pool)
+
+#WsgiToAsgiInstance that runs the WSGI app on _wsgi_pool instead of the single thread-sensitive thread
+class PooledWsgiInstance(WsgiToAsgiInstance):
+    async def run_wsgi_app(self, body):
+        await _run_wsgi_app(self, body)
+
+#/api/stream or /api/<chamber_id>/stream
+STREAM_PATH = re.compile(r'/api/(?:([^/]+)/)?stream')
+
+'''
+Async version of app.stream_status: the same events (full status first, then changed fields, keepalive comments
+every 15s) until the client disconnects.
+'''
+async def stream_status(scope, receive, send, chamber_id):
+    chamber = web.chambers.get(web.default_chamber_id if chamber_id is None else chamber_id)
+    if chamber is None:
+        await send({"type": "http.response.start", "status": 404, "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.body", "body": f"Unknown chamber {chamber_id}".encode()})
+        return
+    loop = asyncio.get_running_loop()
+    #Building the status reads the database, so it runs on the pool
+    await loop.run_in_executor(_wsgi_pool, chamber.publish_status)
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")]})
+
+    async def disconnected():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+    watcher = asyncio.ensure_future(disconnected())
+    version = -1
+    sent = {}
+    try:
+        while not watcher.done():
+            update = asyncio.ensure_future(chamber.status_broadcaster.wait_async(version, timeout=15))
+            await asyncio.wait({update, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not update.done():
+                update.cancel()
+                break
+            version, status = update.result()
+            delta = web.status_delta(sent, status)
+            if delta:
+                sent = status
+                event = f"data: {json.dumps(delta)}\n\n"
+            else:
+                event = ": keepalive\n\n"
+            await send({"type": "http.response.body", "body": event.encode(), "more_body": True})
+    finally:
+        watcher.cancel()
+
+class PooledWsgiToAsgi:
+    def __init__(self, wsgi_application):
+        self.wsgi_application = wsgi_application
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "GET":
+            match = STREAM_PATH.fullmatch(scope["path"])
+            if match:
+                await stream_status(scope, receive, send, match.group(1))
+                return
+        await PooledWsgiInstance(self.wsgi_application)(scope, receive, send)
+
+start_server(watch_heartbeat=False)
+
+asgi_app = PooledWsgiToAsgi(app)
@@ -0,0 +1,83 @@
+'''bench_chambers.py: Checks that chambers served from one process keep their own timing.
+Runs soak tasks on many simulated chambers at once, laid out like the app's chamber registry: chambers alone on
+their port with their own SH241 and poller, chambers sharing an RS-485 line through a BusManager, and one chamber
+that never answers. Reports how late each healthy chamber's soak deadlines fired and the process CPU use; a dead
+chamber should only delay itself.
+
+Usage: python bench_chambers.py [--chambers N] [--shared N] [--tasks N] [--soak SECONDS]
+'''
+
+import argparse
+import threading
+import time
+
+from ESPEC import SH241
+from BusManager import BusManager
+
+SIM_OPTIONS = 'latency=0.005&jitter=0.002&speed=600&tau=2&rate=600'
+
+#Records how late each soak deadline of chamber fired
+def time_deadlines(chamber, lateness):
+    start_next = chamber.startNextTask
+    def timed():
+        if chamber.timer1 is not None:
+            lateness.append(time.monotonic() - chamber.timer1.deadline)
+        start_next()
+    chamber.startNextTask = timed
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float('nan')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chambers', type=int, default=12, help='healthy chambers alone on their port')
+    parser.add_argument('--shared', type=int, default=4, help='healthy chambers sharing one port')
+    parser.add_argument('--tasks', type=int, default=3, help='soak tasks per chamber')
+    parser.add_argument('--soak', type=float, default=2.0, help='soak seconds per task')
+    args = parser.parse_args()
+
+    healthy = [SH241(address=1, port='sim://bench-c%i?%s' % (n, SIM_OPTIONS)) for n in range(args.chambers)]
+    buses = []
+    if args.shared:
+        bus = BusManager('sim://bench-bus?addresses=1-%i&%s' % (args.shared, SIM_OPTIONS), range(1, args.shared + 1),
+                         poll_rate=args.shared / 0.5)
+        buses.append(bus)
+        healthy += list(bus.chambers.values())
+    #Every command to this chamber times out, including each retry
+    dead = SH241(address=1, port='sim://bench-dead?drop=1.0')
+
+    for chamber in healthy[:args.chambers] + [dead]:
+        chamber.OpenChannel()
+    for bus in buses:
+        bus.Open()
+
+    lateness = []
+    for chamber in healthy:
+        time_deadlines(chamber, lateness)
+    for chamber in healthy + [dead]:
+        for n in range(args.tasks):
+            chamber.AddTask(30 + n * 5, 0, 0, int(args.soak), db_id=n)
+
+    cpu_start = time.process_time()
+    started = time.monotonic()
+    #The app starts each chamber's first task from a request thread
+    for chamber in [dead] + healthy:
+        threading.Thread(target=chamber.startTask, daemon=True).start()
+    expected = len(healthy) * args.tasks
+    while len(lateness) < expected and time.monotonic() - started < 120:
+        time.sleep(0.1)
+    wall = time.monotonic() - started
+    cpu = time.process_time() - cpu_start
+
+    print(f"\n{len(healthy)} healthy chambers ({args.chambers} on their own port, {args.shared} on a shared port) "
+          f"and 1 unreachable chamber, {args.tasks} x {args.soak:.0f}s soaks each")
+    print(f"  deadlines fired: {len(lateness)} of {expected} in {wall:.1f}s")
+    print(f"  lateness: p50 {percentile(lateness, 0.5) * 1000:.1f}ms, p99 {percentile(lateness, 0.99) * 1000:.1f}ms, "
+          f"max {max(lateness, default=float('nan')) * 1000:.1f}ms")
+    print(f"  CPU: {cpu / wall * 100:.1f}% of one core")
+    timeouts = sum(counters.get("timeouts", 0) for counters in dead.GetCommandMetrics()[0].counters().values())
+    print(f"  unreachable chamber: {timeouts} timed out commands")
+
+if __name__ == '__main__':
+    main()
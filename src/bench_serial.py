@@ -0,0 +1,85 @@
+'''bench_serial.py: Benchmark of the serial path of SH241 against the controller simulator (or a real port).
+Runs typical sequences and reports wall time, commands/s and round-trip latency percentiles per command verb,
+from the same metrics UARTMaster exports on /api/metrics:
+    start task: startTask (set point + constant mode) followed by stopTask, repeated
+    cycle:      a complete Cycle task, ramps and soaks included
+    polling:    the polls the chamber gets in one hour at the default poll interval, back to back
+
+Usage: python bench_serial.py [--port PORT] [--repeat N] [--polls N]
+The default port is a simulated chamber at 9600 baud with 5 ms controller latency and a fast thermal model.
+'''
+
+import argparse
+import time
+
+from ESPEC import SH241
+
+DEFAULT_PORT = 'sim://bench?latency=0.005&jitter=0.002&speed=3600&tau=5&rate=600&seed=1'
+
+def report(name, chamber, wall):
+    metrics, labels = chamber.GetCommandMetrics()
+    histograms = metrics.histograms()
+    counters = metrics.counters()
+    total = metrics.total()
+    print(f"\n{name}: {wall:.2f}s, {total.count} commands, {total.count / wall:.1f} commands/s, "
+          f"serial {total.sum / wall * 100:.0f}% of wall time")
+    print(f"  {'verb':<18}{'count':>7}{'p50':>10}{'p99':>10}{'timeouts':>10}{'bytes out':>11}{'bytes in':>10}")
+    rows = sorted(histograms.items(), key=lambda item: -item[1].sum) + [("all", total)]
+    for verb, histogram in rows:
+        verb_counters = counters.get(verb, {}) if verb != "all" else {
+            counter: sum(c.get(counter, 0) for c in counters.values()) for counter in ("timeouts", "bytes_sent", "bytes_received")}
+        print(f"  {verb:<18}{histogram.count:>7}{histogram.percentile(0.5) * 1000:>8.1f}ms{histogram.percentile(0.99) * 1000:>8.1f}ms"
+              f"{verb_counters.get('timeouts', 0):>10}{verb_counters.get('bytes_sent', 0):>11}{verb_counters.get('bytes_received', 0):>10}")
+    metrics.reset()
+
+def bench_start_task(chamber, repeat):
+    started = time.perf_counter()
+    for n in range(repeat):
+        chamber.AddTask(30 + n % 10, 0, 10, 0, db_id=n)
+        chamber.startTask()
+        chamber.stopTask()
+    wall = time.perf_counter() - started
+    report(f"start task x{repeat} ({wall / repeat * 1000:.1f}ms per transition)", chamber, wall)
+
+def bench_cycle(chamber, cycles):
+    chamber.task_done = False
+    chamber.AddCycle(-10, 60, 0, 0, 1, cycles, db_id="bench")
+    started = time.perf_counter()
+    chamber.startTask()
+    while not chamber.task_done:
+        time.sleep(0.01)
+    wall = time.perf_counter() - started
+    chamber.stopTask()
+    report(f"cycle ({cycles} cycles of 1s soaks)", chamber, wall)
+
+def bench_polling(chamber, polls):
+    started = time.perf_counter()
+    for _ in range(polls):
+        chamber.PollOnce()
+    wall = time.perf_counter() - started
+    report(f"polling ({polls} polls)", chamber, wall)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', default=DEFAULT_PORT)
+    parser.add_argument('--repeat', type=int, default=50, help='task transitions to time')
+    parser.add_argument('--cycles', type=int, default=3)
+    parser.add_argument('--polls', type=int, default=None, help='default: one hour at the default poll interval')
+    args = parser.parse_args()
+
+    chamber = SH241(address=1, port=args.port, poll=False)
+    chamber.OpenChannel()
+    polls = args.polls if args.polls is not None else int(3600 / chamber.poll_interval.default_interval)
+    #Check targets as often as the poll interval allows, so the cycle is not dominated by waiting
+    chamber.poll_interval.min_interval = 0.05
+    chamber.poll_interval.max_interval = 0.05
+    chamber.poll_interval.default_interval = 0.05
+    chamber.GetCommandMetrics()[0].reset()
+
+    bench_start_task(chamber, args.repeat)
+    bench_cycle(chamber, args.cycles)
+    bench_polling(chamber, polls)
+    chamber.CloseChannel()
+
+if __name__ == '__main__':
+    main()
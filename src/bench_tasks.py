@@ -0,0 +1,67 @@
+'''bench_tasks.py: Micro-benchmark of the task queue operations used by the oven, comparing the original
+LinkedList with TaskQueue at different queue sizes.
+
+Usage: python bench_tasks.py [--full]
+LinkedList is quadratic to build, so it is skipped above 10k tasks unless --full is given.
+'''
+
+import random
+import sys
+import time
+
+from Tasks import LinkedList, TaskQueue, Task
+
+#Delete by db_id the way SH241.deleteTask used to: walk the list until the id matches
+def linked_list_delete(tasklist, db_id):
+    current = tasklist.head
+    previous = None
+    while current:
+        if current.data.db_id == db_id:
+            if previous is None:
+                tasklist.head = current.next
+            else:
+                previous.next = current.next
+            return True
+        previous = current
+        current = current.next
+    return False
+
+def run(queue_class, delete, size, deletes):
+    tasks = [Task(25.0, 0, 1, 0, "Task", db_id) for db_id in range(size)]
+    victims = random.sample(range(size), deletes)
+    queue = queue_class()
+
+    start = time.perf_counter()
+    for task in tasks:
+        queue.enqueue(task)
+    enqueue_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for db_id in victims:
+        delete(queue, db_id)
+    delete_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    while queue.head:
+        queue.pop_head()
+    pop_time = time.perf_counter() - start
+    return enqueue_time, delete_time, pop_time
+
+def main():
+    full = "--full" in sys.argv
+    random.seed(0)
+    print(f"{'queue':<11}{'tasks':>8}{'enqueue/op':>14}{'delete/op':>14}{'pop/op':>14}")
+    for size in (10, 1000, 100000):
+        deletes = max(1, size // 10)
+        for name, queue_class, delete in (("LinkedList", LinkedList, linked_list_delete),
+                                          ("TaskQueue", TaskQueue, TaskQueue.delete)):
+            if queue_class is LinkedList and size > 10000 and not full:
+                print(f"{name:<11}{size:>8}{'skipped (use --full)':>42}")
+                continue
+            enqueue_time, delete_time, pop_time = run(queue_class, delete, size, deletes)
+            remaining = size - deletes
+            print(f"{name:<11}{size:>8}{enqueue_time / size * 1e6:>12.2f}us{delete_time / deletes * 1e6:>12.2f}us"
+                  f"{pop_time / max(1, remaining) * 1e6:>12.2f}us")
+
+if __name__ == '__main__':
+    main()